@@ -77,4 +77,34 @@ CREATE TABLE IF NOT EXISTS mtmpl (
     mtmpl_uuid VARCHAR(36) NOT NULL,
     mtmpl_title TEXT NOT NULL,
     create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
+
+-- sendlog：所有任務的寄送紀錄，依 sendtask_uuid 分區（LIST），每個任務一個分區 sendlog_<sendtask_uuid>
+-- 分區由 ApplianceDB.create_sendlog_partition 建立，舊任務可 detach 後封存或刪除
+CREATE TABLE IF NOT EXISTS sendlog (
+    id BIGSERIAL,
+    sendtask_uuid VARCHAR(36) NOT NULL,
+    uuid TEXT NOT NULL,
+    target_email TEXT,
+    template_uuid TEXT,
+    qrcode_access_active TEXT[],
+    qrcode_access_ip TEXT[],
+    qrcode_access_time BIGINT[],
+    person_info TEXT,
+    plan_time BIGINT,
+    send_time BIGINT,
+    send_res TEXT,
+    access_time BIGINT[],
+    access_src TEXT[],
+    access_dev TEXT[],
+    click_time BIGINT[],
+    click_src TEXT[],
+    click_dev TEXT[],
+    file_time BIGINT[],
+    file_src TEXT[],
+    file_dev TEXT[],
+    PRIMARY KEY (sendtask_uuid, uuid)
+) PARTITION BY LIST (sendtask_uuid);
+
+-- detach 後封存的 sendlog 分區
+CREATE SCHEMA IF NOT EXISTS sendlog_archive;
@@ -5,14 +5,214 @@
 支援的資料表包括 sendtasks、accts、users 等，並提供建立新資料表、清空資料表、檢查資料表是否存在等功能。
 '''
 
+import os
 import re
+import json
+import time
+import base64
+import hashlib
+import asyncio
 import asyncpg
 import aiofiles
 
 from app.services.log_manager import Logger
+from app.services.metrics import track_db
+
+
+logger = Logger().get_logger(__name__)
+
+# 建立、刪除 sendlog 分區時發出的 NOTIFY 頻道，loginapp 的任務登錄表會監聽
+TABLE_CHANNEL = os.getenv("TABLE_NOTIFY_CHANNEL", "sendtask_tables")
+
+# 所有任務共用的 sendlog 分區表（schema 見 config/table_info.sql），detach 的分區封存到 SENDLOG_ARCHIVE_SCHEMA
+SENDLOG_TABLE = "sendlog"
+SENDLOG_ARCHIVE_SCHEMA = "sendlog_archive"
+# 移除任務時封存分區（1）或直接刪除（0，預設）
+SENDLOG_ARCHIVE_ON_REMOVE = os.getenv("SENDLOG_ARCHIVE_ON_REMOVE", "0") == "1"
+# sendtask uuid 會組進分區名稱與 FOR VALUES IN，只允許英數、底線與連字號
+SENDTASK_UUID_PATTERN = re.compile(r'^[a-zA-Z0-9_-]{1,36}$')
+# 分區是否仍掛在 sendlog 底下（detach 後不算）
+SENDLOG_ATTACHED_SQL = (
+    "SELECT EXISTS (SELECT FROM pg_inherits WHERE inhparent = $1::regclass "
+    "AND inhrelid = to_regclass(quote_ident($2)))"
+)
+
+# sendlog 明細查詢（data_api._query_sendlog_details）用到的索引。
+# 啟動時以 ON ONLY 建在分區表上，之後新增的分區會自動建立；
+# 既有分區的索引由 build_sendlog_indexes（背景或 sendlog_migration --build-indexes）在交易外補上。
+# 排序索引帶 id 作為同值排序依據，keyset 分頁可直接沿索引接續；遞減排序時反向掃描同一個索引。
+SENDLOG_INDEXES = {
+    "sendlog_plan_time_idx": "(sendtask_uuid, plan_time, id)",
+    "sendlog_send_time_idx": "(sendtask_uuid, send_time, id)",
+    "sendlog_target_email_idx": "(sendtask_uuid, target_email, id)",
+    # 「已開啟／已點擊／已開檔」篩選，條件需與查詢的寫法相同才會使用
+    "sendlog_accessed_idx": "(sendtask_uuid, id) WHERE array_length(access_time, 1) > 0",
+    "sendlog_clicked_idx": "(sendtask_uuid, id) WHERE array_length(click_time, 1) > 0",
+    "sendlog_filed_idx": "(sendtask_uuid, id) WHERE array_length(file_time, 1) > 0",
+    # 搜尋（ILIKE '%...%'）用的 trigram 索引，需要 pg_trgm extension
+    "sendlog_target_email_trgm_idx": "USING gin (target_email gin_trgm_ops)",
+    "sendlog_person_info_trgm_idx": "USING gin (person_info gin_trgm_ops)",
+}
+
+# sendlog 寄送結果的判斷條件，明細頁的 resultType 篩選與跨任務搜尋的 status 共用
+# triggered 的寫法需與 sendlog_accessed_idx 的條件相同才會使用索引
+SENDLOG_RESULT_CONDITIONS = {
+    "notyet": "(send_time IS NULL OR send_time = 0)",
+    "send": "(send_time IS NOT NULL AND send_time > 0 AND send_res IS NOT NULL AND send_res ILIKE '%True%')",
+    "failed": "(send_time IS NOT NULL AND send_time > 0 AND send_res IS NOT NULL AND send_res ILIKE '%False%')",
+    "not_triggered": "(send_time IS NOT NULL AND send_time > 0 AND send_res IS NOT NULL AND send_res ILIKE '%True%' "
+                     "AND array_length(access_time, 1) IS NULL)",
+    "triggered": "array_length(access_time, 1) > 0",
+}
+
+def sendlog_status_sql() -> str:
+    """ 以 SENDLOG_RESULT_CONDITIONS 把每筆 sendlog 分類為 notyet／failed／triggered／send，都不符合時為 unknown """
+    cases = " ".join(f"WHEN {SENDLOG_RESULT_CONDITIONS[status]} THEN '{status}'"
+                     for status in ("notyet", "failed", "triggered", "send"))
+    return f"CASE {cases} ELSE 'unknown' END"
+
+def contains_pattern(text: str) -> str:
+    """ 「包含 text」的 LIKE/ILIKE 樣式，text 內的 % _ \\ 視為一般字元 """
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def sendlog_partition(sendtask_uuid: str) -> str:
+    """ 任務對應的 sendlog 分區名稱 """
+    if not SENDTASK_UUID_PATTERN.match(sendtask_uuid or ""):
+        raise ValueError(f"不合法的 sendtask uuid：{sendtask_uuid}")
+    return f"{SENDLOG_TABLE}_{sendtask_uuid}"
+
+def encode_cursor(position: dict) -> str:
+    """ 把 keyset 分頁的位置編成不透明的 cursor 字串 """
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """ 解開 encode_cursor 產生的 cursor """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("無效的分頁 cursor")
+    if not isinstance(position, dict) or not isinstance(position.get("id"), int):
+        raise ValueError("無效的分頁 cursor")
+    return position
+
+def cursor_query_hash(table_name: str, where_sql: str, params: list, rows_per_page: int) -> str:
+    """ 查詢條件與每頁筆數的摘要，放進 cursor 以拒絕套用在其他查詢上的 cursor """
+    raw = json.dumps([table_name, " ".join(where_sql.split()), params, rows_per_page], default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+def keyset_clause(sort_field: str | None, descending: bool, value, last_id: int, start: int) -> tuple[str, list]:
+    """
+    keyset 分頁的 WHERE 條件：排在 (value, last_id) 之後的資料。
+    NULL 的位置與 Postgres 預設相同（ASC 時在最後，DESC 時在最前）。
+
+    :param sort_field: 排序欄位，None 表示只依 id 排序。
+    :param descending: 是否為遞減排序。
+    :param value: 上一頁最後一筆的排序欄位值。
+    :param last_id: 上一頁最後一筆的 id。
+    :param start: 第一個參數的編號（$start）。
+    :return: (條件 SQL, 參數列表)。
+    """
+    op = "<" if descending else ">"
+    if sort_field is None:
+        return f"id {op} ${start}", [last_id]
+    if value is None:
+        if descending:
+            # NULL 排在最前：剩下的 NULL，以及所有非 NULL
+            return f"(({sort_field} IS NULL AND id < ${start}) OR {sort_field} IS NOT NULL)", [last_id]
+        return f"({sort_field} IS NULL AND id > ${start})", [last_id]
+    clause = f"({sort_field}, id) {op} (${start}, ${start + 1})"
+    if not descending:
+        # NULL 排在最後
+        clause = f"({clause} OR {sort_field} IS NULL)"
+    return clause, [value, last_id]
+
+class CountCache:
+    """
+    get_paginated_db 總筆數的快取，key 為 (資料表, 正規化後的 WHERE, 參數, 是否為估計值)。
+    寫入資料後以 invalidate 清除；每個 worker 各自快取，其他 worker 最多在 ttl 秒後更新。
+    invalidate 會遞增 (資料表, 值) 的世代編號；查詢前先以 generation 取得編號，
+    put 時編號已改變（查詢期間有寫入）就不寫入快取，避免把舊的筆數放回去。
+
+    可用環境變數調整：
+        COUNT_CACHE_TTL          快取秒數（預設 60，0 表示不快取）
+        COUNT_CACHE_MAX_ENTRIES  最多快取幾組條件（預設 1000）
+    """
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("COUNT_CACHE_TTL", 60))
+        self.max_entries = max_entries or int(os.getenv("COUNT_CACHE_MAX_ENTRIES", 1000))
+        # key -> (過期時間, 筆數)，依寫入順序排列
+        self._entries = {}
+        # (資料表, 值) -> 世代編號，值為 None 表示整個資料表
+        self._generations = {}
+
+    @staticmethod
+    def key(table_name: str, where_sql: str, params: list, estimate: bool) -> tuple:
+        normalized = " ".join(where_sql.split())
+        values = tuple(tuple(value) if isinstance(value, list) else value for value in params)
+        return (table_name, normalized, values, estimate)
+
+    def get(self, key: tuple) -> int | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
 
+    def generation(self, key: tuple) -> tuple:
+        """ key 目前的世代編號：整個資料表的編號，加上參數中每個值的編號 """
+        table_name = key[0]
+        return (self._generations.get((table_name, None), 0),
+                tuple(self._generations.get((table_name, value), 0) for value in key[2]))
 
-logger = Logger().get_logger()
+    def put(self, key: tuple, count: int, generation: tuple = None):
+        """
+        寫入快取
+        :param generation: 查詢前以 generation(key) 取得的編號；之後若被 invalidate 過就不寫入。
+        """
+        if self.ttl <= 0:
+            return
+        if generation is not None and generation != self.generation(key):
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, count)
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, table_name: str, value=None):
+        """
+        清除資料表的快取
+        :param table_name: 資料表名稱。
+        :param value: 若提供，只清除參數中含有此值的條件（例如 sendtask_uuid）。
+        """
+        self._generations[(table_name, value)] = self._generations.get((table_name, value), 0) + 1
+        for key in [key for key in self._entries
+                    if key[0] == table_name and (value is None or value in key[2])]:
+            del self._entries[key]
+
+# 視為連線中斷、需要 supervisor 檢查連線池的錯誤
+# 單一連線被重置（ConnectionError）時 asyncpg 會自行丟棄那條連線，不列在這裡
+CONNECTION_ERRORS = (
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.AdminShutdownError,
+    asyncpg.exceptions.CrashShutdownError,
+    asyncpg.exceptions.CannotConnectNowError,
+)
+
+def pool_max_size() -> int:
+    """
+    每個 worker 的連線池上限。
+    有設定 DB_POOL_MAX_SIZE 就直接使用；否則把這個 app 可用的 Postgres 連線數
+    DB_MAX_CONNECTIONS（預設 30）平均分給 WEB_WORKERS 個 worker，最多 10 條。
+    """
+    if os.getenv("DB_POOL_MAX_SIZE"):
+        return int(os.getenv("DB_POOL_MAX_SIZE"))
+    budget = int(os.getenv("DB_MAX_CONNECTIONS", 30))
+    workers = int(os.getenv("WEB_WORKERS", 1))
+    return max(1, min(10, budget // workers))
 
 class ApplianceDB:
     def __init__(self):
@@ -23,78 +223,225 @@ class ApplianceDB:
             "accts": {"acct_id", "acct_uuid", "acct_email", "acct_full_name", "acct_full_name_2nd", "acct_activate", "orgs"},
             "users": {"username", "password_hash", "email", "full_name", "orgs", "create_time"}
         }
-
-    async def db_init(self):
-        """ 初始化資料庫連線池與資料表 """
-        if self.db_pool is not None:
-            return
-        
+        # get_paginated_db 的總筆數快取
+        self.count_cache = CountCache()
+        # 連線池監控：連線中斷時由 asyncpg 通知，背景 supervisor 確認後重建連線池
+        self.health_interval = float(os.getenv("DB_HEALTH_INTERVAL", 30))
+        self._pool_lock = asyncio.Lock()
+        self._pool_lost = asyncio.Event()
+        self._supervisor = None
+        # 取得連線的等待時間（秒）與目前等待中的數量，給 /metrics 使用
+        self.pool_wait_count = 0
+        self.pool_wait_total = 0.0
+        self.pool_wait_max = 0.0
+        self.pool_waiting = 0
+
+    async def _create_pool(self):
         logger.debug("Initializing PostgreSQL connection pool...")
         # 使用 asyncpg 建立連線池
-        self.db_pool = await asyncpg.create_pool(
+        return await asyncpg.create_pool(
             host='postgres-db',
             port=5432,
             user='myuser',
             password='mypassword',
             database='mydatabase',
             min_size=1,
-            max_size=10
+            max_size=pool_max_size(),
+            init=self._init_connection
         )
 
-        async with self.db_pool.acquire() as connection:
-            with open("app/core/config/table_info.sql", mode="r") as f:
-                schema_sql = f.read()
+    async def _init_connection(self, connection):
+        """ 每條新連線都註冊中斷通知 """
+        connection.add_termination_listener(self._on_connection_terminated)
+
+    def _on_connection_terminated(self, connection):
+        """ 連線關閉時喚醒 supervisor 做一次健康檢查 """
+        self._pool_lost.set()
+
+    async def db_init(self):
+        """ 初始化資料庫連線池與資料表 """
+        if self.db_pool is not None:
+            return
+
+        self.db_pool = await self._create_pool()
+
+        with open("app/core/config/table_info.sql", mode="r") as f:
+            schema_sql = f.read()
+
+        async def create_schema(connection):
+            # 多個 worker 同時啟動時，CREATE TABLE IF NOT EXISTS 仍可能互相衝突，先取得鎖再建表
+            async with connection.transaction():
+                await connection.execute("SELECT pg_advisory_xact_lock(hashtext('adminapp_schema'))")
                 for stmt in schema_sql.strip().split(";"):
                     stmt = stmt.strip()
                     if not stmt:
                         continue  # skip empty statements
                     await connection.execute(stmt)
-
+                # trigram 索引需要 pg_trgm；無法建立 extension 時（權限不足等）略過，搜尋仍可用但會掃描整個分區
+                has_trgm = True
+                try:
+                    async with connection.transaction():
+                        await connection.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                except asyncpg.exceptions.PostgresError as e:
+                    has_trgm = False
+                    logger.warning(f"pg_trgm is not available, skipping trigram indexes: {e}")
+                # sendlog 明細查詢的索引：ON ONLY 只建立父索引（只改 catalog），之後新建的分區會自動建立對應索引；
+                # 已存在的分區不在這裡建立（會在交易內鎖住整個 sendlog），由 build_sendlog_indexes 在交易外補上
+                for name, definition in SENDLOG_INDEXES.items():
+                    if "gin_trgm_ops" in definition and not has_trgm:
+                        continue
+                    await connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {SENDLOG_TABLE} {definition}")
+
+        await self._execute(create_schema, retry=True)
+        self._supervisor = asyncio.create_task(self._supervise())
 
     async def db_close(self):
+        if self._supervisor:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
         if self.db_pool:
             logger.debug("Closing PostgreSQL connection pool...")
             await self.db_pool.close()
             self.db_pool = None
 
     async def check_db_connection(self):
-        """ 檢查資料庫連線，若斷線則重新初始化 """
+        """ 確認連線池已建立；斷線偵測與重建交給背景 supervisor """
         if self.db_pool is None:
-            await self.db_init()
-            return
+            await self._rebuild_pool(None)
+
+    async def _rebuild_pool(self, broken_pool):
+        """
+        重建連線池。多個請求同時發現斷線時只會重建一次。
+
+        :param broken_pool: 發生錯誤時使用的連線池，若已被換掉就不再重建。
+        """
+        async with self._pool_lock:
+            if self.db_pool is not broken_pool:
+                return
+            self.db_pool = None
+            if broken_pool is not None:
+                broken_pool.terminate()
+            self.db_pool = await self._create_pool()
+            logger.info("PostgreSQL connection pool rebuilt.")
+
+    async def _supervise(self):
+        """ 背景監控：連線中斷或每隔 health_interval 秒檢查一次，失敗就重建連線池 """
+        while True:
+            try:
+                await asyncio.wait_for(self._pool_lost.wait(), timeout=self.health_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._pool_lost.clear()
+
+            pool = self.db_pool
+            try:
+                if pool is None:
+                    raise ConnectionError("connection pool is not available")
+                async with pool.acquire() as connection:
+                    await connection.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Database connection lost: {e}. Reinitializing...")
+                try:
+                    await self._rebuild_pool(pool)
+                except Exception as e:
+                    logger.error(f"Failed to rebuild connection pool: {e}")
+
+    async def _execute(self, operation, retry: bool = False):
+        """
+        取一條連線執行 operation(connection)。
+        遇到連線層錯誤時通知 supervisor 檢查連線池（確認失敗才重建，不會中斷其他連線上的查詢）；
+        retry=True（冪等的讀取）時會再試一次。
 
+        :param operation: 接收 connection、回傳 coroutine 的函式。
+        :param retry: 是否在發生連線層錯誤後重試一次。
+        """
+        pool = self.db_pool
+        if pool is None:
+            await self.check_db_connection()
+            pool = self.db_pool
         try:
-            async with self.db_pool.acquire() as connection:
-                await connection.fetch("SELECT 1")
-        except Exception as e:
-            logger.error(f"Database connection lost: {e}. Reinitializing...")
-            await self.db_close()
-            await self.db_init()
+            start = time.perf_counter()
+            self.pool_waiting += 1
+            try:
+                connection = await pool.acquire()
+            finally:
+                self.pool_waiting -= 1
+            self._record_pool_wait(time.perf_counter() - start)
+            try:
+                return await operation(connection)
+            finally:
+                await pool.release(connection)
+        except CONNECTION_ERRORS as e:
+            logger.warning(f"Database connection error: {e}. Checking connection pool...")
+            self._pool_lost.set()
+            if not retry:
+                raise
+        async with (self.db_pool or pool).acquire() as connection:
+            return await operation(connection)
+
+    def _record_pool_wait(self, seconds: float):
+        self.pool_wait_count += 1
+        self.pool_wait_total += seconds
+        self.pool_wait_max = max(self.pool_wait_max, seconds)
+
+    async def _execute_and_notify(self, connection, sql_cmd: str, payload: str):
+        """ 在同一個交易內執行 DDL 並發出通知，交易提交後監聽端才會收到 """
+        async with connection.transaction():
+            await connection.execute(sql_cmd)
+            await connection.execute("SELECT pg_notify($1, $2)", TABLE_CHANNEL, payload)
 
+    @track_db
     async def table_exists(self, table_name: str) -> bool:
         """ 
         檢查 table 是否存在 
         :param table_name: 欲檢查的資料表名稱
         :return: 如果資料表存在，返回 True，否則返回 False
         """
-        await self.check_db_connection()
-        async with self.db_pool.acquire() as connection:
-            query = "SELECT EXISTS (SELECT FROM pg_tables WHERE tablename = $1)"
-            result = await connection.fetchval(query, table_name)
-            return result
+        query = "SELECT EXISTS (SELECT FROM pg_tables WHERE tablename = $1)"
+        result = await self._execute(lambda connection: connection.fetchval(query, table_name), retry=True)
+        return result
         
+    @track_db
+    async def tables_exist(self, table_names: list[str], parent: str = None) -> dict[str, bool]:
+        """
+        以一次查詢檢查多個 table 是否存在
+        :param table_names: 欲檢查的資料表名稱列表
+        :param parent: 若提供，只有仍掛在這個分區表底下的分區才算存在
+        :return: {資料表名稱: 是否存在}
+        """
+        if not table_names:
+            return {}
+        query = (
+            "SELECT c.relname FROM pg_class c "
+            "WHERE c.relnamespace = current_schema()::regnamespace AND c.relkind IN ('r', 'p') "
+            "AND c.relname = ANY($1::TEXT[])"
+        )
+        args = [list(table_names)]
+        if parent is not None:
+            query += " AND EXISTS (SELECT FROM pg_inherits i WHERE i.inhrelid = c.oid AND i.inhparent = $2::regclass)"
+            args.append(parent)
+        rows = await self._execute(lambda connection: connection.fetch(query, *args), retry=True)
+        existing = {row["relname"] for row in rows}
+        return {name: name in existing for name in table_names}
+
+    @track_db
     async def table_empty(self, table_name: str) -> bool:
         """ 
         檢查 table 是否為空 
         :param table_name: 欲檢查的資料表名稱
         :return: 如果資料表為空，返回 True，否則返回 False
         """
-        await self.check_db_connection()
-        async with self.db_pool.acquire() as connection:
-            query = f"SELECT COUNT(*) FROM \"{table_name}\""
-            count = await connection.fetchval(query)
-            return count == 0
+        query = f"SELECT COUNT(*) FROM \"{table_name}\""
+        count = await self._execute(lambda connection: connection.fetchval(query), retry=True)
+        return count == 0
 
+    @track_db
     async def create_table(self, table_name: str, columns: dict):
         """
         建立新資料表。
@@ -105,8 +452,6 @@ class ApplianceDB:
         if not table_name or not isinstance(columns, dict) or not columns:
             raise ValueError("請提供有效的 table_name 與欄位定義 dict。")
 
-        await self.check_db_connection()
-
         # 避免 SQL Injection: 僅允許英數底線開頭的命名
         if not re.match(r'^[a-zA-Z0-9_]+$', table_name):
             raise ValueError("不合法的資料表名稱")
@@ -118,20 +463,20 @@ class ApplianceDB:
         col_defs = ', '.join(f"{col} {dtype}" for col, dtype in columns.items())
         sql_cmd = f'CREATE TABLE IF NOT EXISTS "{table_name}" ({col_defs});'
 
-        async with self.db_pool.acquire() as connection:
-            await connection.execute(sql_cmd)
-            logger.info(f"Table `{table_name}` created successfully.")
+        await self._execute(lambda connection: self._execute_and_notify(connection, sql_cmd, f"create:{table_name}"),
+                            retry=True)
+        logger.info(f"Table `{table_name}` created successfully.")
         # 加入白名單允許
         self.allowed_tables.add(table_name)
         self.allowed_columns[table_name] = set(columns.keys())
 
+    @track_db
     async def clear_table(self, table_name: str):
         """ 清空整個資料表 """
-        await self.check_db_connection()
-        async with self.db_pool.acquire() as connection:
-            sql_cmd = f'DELETE FROM "{table_name}"'
-            await connection.execute(sql_cmd)
+        sql_cmd = f'DELETE FROM "{table_name}"'
+        await self._execute(lambda connection: connection.execute(sql_cmd), retry=True)
 
+    @track_db
     async def get_db(self, table_name: str, select_columns: list[str] = None, where_column: str = None, values: str | list[str] = None) -> list[dict]:
         """
         查詢資料，支援欄位選擇與條件過濾（IN 查詢）。
@@ -143,8 +488,6 @@ class ApplianceDB:
         :return: 查詢結果列表，每筆為 dict 格式。
         :raises ValueError: 傳入值與參數組合不合法時拋出錯誤。
         """
-        await self.check_db_connection()
-
         # 欄位處理
         if select_columns:
             col_str = ', '.join(select_columns)
@@ -168,67 +511,115 @@ class ApplianceDB:
         # 組合 SQL
         sql_cmd = f'SELECT {col_str} FROM "{table_name}"{where_clause}'
 
-        async with self.db_pool.acquire() as connection:
-            result = await connection.fetch(sql_cmd, *bind_values)
-            return [dict(row) for row in result] if result else []
+        result = await self._execute(lambda connection: connection.fetch(sql_cmd, *bind_values), retry=True)
+        return [dict(row) for row in result] if result else []
 
-    async def get_paginated_db(self, table_name: str, paginate: bool = True, page: int = 1, rows_per_page: int = 20, where_clauses: list[str] = None, params: list = None, order_by: str = None):
+    @track_db
+    async def get_paginated_db(self, table_name: str, paginate: bool = True, page: int = 1, rows_per_page: int = 20, where_clauses: list[str] = None, params: list = None, order_by: str = None, cursor: str = None, estimate_count: bool = False):
         """
         查詢資料，支援分頁、篩選和排序。
+        分頁有兩種方式：
+            - OFFSET：依 page 跳到指定頁，越後面的頁越慢
+            - keyset：傳入 cursor（第一頁傳空字串），依 (排序欄位, id) 從上一頁的最後一筆接續，每一頁成本相同
 
         :param table_name: 欲查詢的資料表名稱。
         :param paginate: 是否啟用分頁。若為 False，則回傳所有符合條件的資料。
-        :param page: 當前頁碼 (從 1 開始)。
+        :param page: 當前頁碼 (從 1 開始)，只用於 OFFSET 分頁。
         :param rows_per_page: 每頁筆數。
         :param where_clauses: SQL WHERE 條件子句列表 (例如 ["target_email LIKE %s", "send_time > %s"])。
         :param params: 對應 WHERE 條件的參數列表。
         :param order_by: 排序依據 (例如 "plan_time DESC")。
-        :return: 一個包含 'data' (當頁資料) 和 'total_count' (總筆數) 的字典。
+        :param cursor: 上一次回傳的 next_cursor；不為 None 時使用 keyset 分頁。
+        :param estimate_count: 以 planner 的估計筆數代替 COUNT(*)，適合沒有額外篩選的大量資料。
+        :return: 一個包含 'data' (當頁資料)、'total_count' (總筆數)、'total_count_estimated' (總筆數是否為估計值)
+                 和 'next_cursor' (下一頁的 cursor，沒有下一頁或非 keyset 分頁時為 None) 的字典。
+                 總筆數會快取在 count_cache，寫入資料後需呼叫 count_cache.invalidate。
+        :raises ValueError: cursor 無效，或與排序條件、篩選條件、每頁筆數不符。
         """
-        await self.check_db_connection()
-
         if params is None:
             params = []
-        
-        offset = (page - 1) * rows_per_page
-
-        # 組合 WHERE 條件
-        where_sql = ""
-        if where_clauses:
-            where_sql = "WHERE " + " AND ".join(where_clauses)
 
         # 組合 ORDER BY 條件
-        order_sql = ""
+        sort_field, descending = None, False
         if order_by:
             # 簡單的白名單驗證，防止 SQL Injection
             allowed_sort_columns = ["target_email", "plan_time", "send_time", "person_info"]
-            sort_field = order_by.split()[0]
-            if sort_field in allowed_sort_columns:
-                order_sql = f"ORDER BY {order_by}"
+            sort_parts = order_by.split()
+            if sort_parts[0] in allowed_sort_columns:
+                sort_field = sort_parts[0]
+                descending = len(sort_parts) > 1 and sort_parts[1].upper() == "DESC"
+        direction = "DESC" if descending else "ASC"
+        # 以 id 作為同值時的排序依據，分頁才穩定
+        order_sql = f"ORDER BY {sort_field} {direction}, id {direction}" if sort_field else f"ORDER BY id {direction}"
+
+        # 組合 WHERE 條件
+        where_sql = ""
+        if where_clauses:
+            where_sql = "WHERE " + " AND ".join(where_clauses)
 
         # 組合計算總數的 SQL
         count_sql = f'SELECT COUNT(*) FROM "{table_name}" {where_sql}'
 
-        # 組合查詢資料的 SQL
-        data_sql = f'SELECT * FROM "{table_name}" {where_sql} {order_sql}'
-
+        keyset = paginate and cursor is not None
+        query_hash = cursor_query_hash(table_name, where_sql, params, rows_per_page) if keyset else None
+        data_clauses = list(where_clauses or [])
         final_params = params.copy()
+        if keyset and cursor:
+            position = decode_cursor(cursor)
+            if position.get("s") != sort_field or position.get("d") != descending:
+                raise ValueError("分頁 cursor 與排序條件不符")
+            if position.get("q") != query_hash:
+                raise ValueError("分頁 cursor 與篩選條件或每頁筆數不符")
+            clause, clause_params = keyset_clause(sort_field, descending, position.get("v"), position.get("id"),
+                                                  len(final_params) + 1)
+            data_clauses.append(clause)
+            final_params.extend(clause_params)
+        data_where_sql = "WHERE " + " AND ".join(data_clauses) if data_clauses else ""
 
-        if paginate:
+        # 組合查詢資料的 SQL
+        data_sql = f'SELECT * FROM "{table_name}" {data_where_sql} {order_sql}'
+
+        if keyset:
+            # 多取一筆判斷是否還有下一頁
+            data_sql += f' LIMIT ${len(final_params) + 1}'
+            final_params.append(rows_per_page + 1)
+        elif paginate:
             offset = (page - 1) * rows_per_page
-            data_sql += f' LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}'
+            data_sql += f' LIMIT ${len(final_params) + 1} OFFSET ${len(final_params) + 2}'
             final_params.extend([rows_per_page, offset])
 
-        async with self.db_pool.acquire() as connection:
-            # 執行查詢
-            total_count = await connection.fetchval(count_sql, *params)
+        count_key = self.count_cache.key(table_name, where_sql, params, estimate_count)
+        cached_count = self.count_cache.get(count_key)
+        count_generation = self.count_cache.generation(count_key)
+
+        async def query(connection):
+            # 執行查詢；總筆數有快取就不再計算
+            total_count = cached_count
+            if total_count is None and estimate_count:
+                plan = await connection.fetchval(f'EXPLAIN (FORMAT JSON) SELECT 1 FROM "{table_name}" {where_sql}', *params)
+                total_count = int((json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]["Plan Rows"])
+            elif total_count is None:
+                total_count = await connection.fetchval(count_sql, *params)
             rows = await connection.fetch(data_sql, *final_params)
+            return total_count, rows
+
+        total_count, rows = await self._execute(query, retry=True)
+        if cached_count is None:
+            self.count_cache.put(count_key, total_count, generation=count_generation)
+        next_cursor = None
+        if keyset and len(rows) > rows_per_page:
+            rows = rows[:rows_per_page]
+            last = rows[-1]
+            next_cursor = encode_cursor({"s": sort_field, "d": descending, "q": query_hash,
+                                         "v": last[sort_field] if sort_field else None, "id": last["id"]})
+        return {
+            "data": [dict(row) for row in rows],
+            "total_count": total_count or 0,
+            "total_count_estimated": estimate_count,
+            "next_cursor": next_cursor
+        }
 
-            return {
-                "data": [dict(row) for row in rows],
-                "total_count": total_count or 0
-            }    
-
+    @track_db
     async def insert_db(self, table_name: str, data: dict | list[dict]):
         """
         插入單筆或多筆資料，並自動分批避免 asyncpg 的參數數量限制。
@@ -243,9 +634,7 @@ class ApplianceDB:
         if not data:
             return None
 
-        await self.check_db_connection()
-
-        async with self.db_pool.acquire() as connection:
+        async def insert(connection):
             if isinstance(data, dict):
                 columns = list(data.keys())
                 col_str = ', '.join(columns)
@@ -291,6 +680,9 @@ class ApplianceDB:
             else:
                 raise TypeError("data 必須是 dict 或 list[dict]")
 
+        return await self._execute(insert)
+
+    @track_db
     async def update_db(self, table_name: str, data: dict, condition: dict):
         """ 
         更新資料
@@ -301,17 +693,16 @@ class ApplianceDB:
         :return: 更新後的資料（dict 格式）。
         :raises ValueError: 若無符合條件的資料可更新。
         """
-        await self.check_db_connection()
-        async with self.db_pool.acquire() as connection:
-            set_clause = ', '.join(f"{key} = ${i+1}" for i, key in enumerate(data.keys()))
-            condition_clause = ' AND '.join(f"{key} = ${len(data) + i+1}" for i, key in enumerate(condition.keys()))
-            sql_cmd = f'UPDATE "{table_name}" SET {set_clause} WHERE {condition_clause} RETURNING *'
-            result = await connection.fetchrow(sql_cmd, *data.values(), *condition.values())
-            if not result:
-                raise ValueError(f"Operation failed on {table_name}, possibly due to missing matching records.")
-            
-            return dict(result) if result else None
+        set_clause = ', '.join(f"{key} = ${i+1}" for i, key in enumerate(data.keys()))
+        condition_clause = ' AND '.join(f"{key} = ${len(data) + i+1}" for i, key in enumerate(condition.keys()))
+        sql_cmd = f'UPDATE "{table_name}" SET {set_clause} WHERE {condition_clause} RETURNING *'
+        result = await self._execute(lambda connection: connection.fetchrow(sql_cmd, *data.values(), *condition.values()))
+        if not result:
+            raise ValueError(f"Operation failed on {table_name}, possibly due to missing matching records.")
 
+        return dict(result) if result else None
+
+    @track_db
     async def upsert_db(self, table_name: str, data: dict, conflict_keys: list[str]) -> str:
         """
         有就更新，沒有就新增。若資料內容相同則不做任何動作。
@@ -323,7 +714,6 @@ class ApplianceDB:
             - "changed"：資料已新增或更新。
             - "unchanged"：資料內容完全相同，未進行任何變更。
         """
-        await self.check_db_connection()
         columns = list(data.keys())
         col_str = ', '.join(columns)
         placeholders = ', '.join(f'${i+1}' for i in range(len(columns)))
@@ -341,11 +731,64 @@ class ApplianceDB:
             f'RETURNING true'
         )
 
-        async with self.db_pool.acquire() as connection:
-            result = await connection.fetchval(sql_cmd, *data.values())
-            return "changed" if result else "unchanged"
+        result = await self._execute(lambda connection: connection.fetchval(sql_cmd, *data.values()))
+        return "changed" if result else "unchanged"
+
+
+    @track_db
+    async def bulk_upsert_db(self, table_name: str, data: list[dict], conflict_keys: list[str]) -> int:
+        """
+        批次 upsert：COPY 到暫存表後，以一個 INSERT ... ON CONFLICT DO UPDATE 寫入，
+        只更新內容有變動的資料列。整批在同一個交易內完成。
+
+        :param table_name: 資料表名稱。
+        :param data: 欲 upsert 的資料列表（list[dict]），欄位以第一筆為準。
+        :param conflict_keys: 判定唯一性的欄位名稱列表，用於 ON CONFLICT 子句。
+                              同一批內重複的 key 只保留最後一筆。
+        :return: 新增或更新的筆數，0 表示整批資料都沒有變動。
+        """
+        if not data:
+            return 0
+        columns = list(data[0].keys())
+        for col in columns:
+            if not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', col):
+                raise ValueError(f"不合法的欄位名稱：{col}")
 
+        # ON CONFLICT 同一列在一個指令內不能更新兩次，先依 key 去重
+        records = {}
+        for item in data:
+            records[tuple(item.get(col) for col in conflict_keys)] = tuple(item.get(col) for col in columns)
 
+        col_str = ', '.join(columns)
+        update_columns = [col for col in columns if col not in conflict_keys]
+        conflict_str = ', '.join(conflict_keys)
+        if update_columns:
+            update_str = ', '.join(f"{col} = EXCLUDED.{col}" for col in update_columns)
+            where_str = ' OR '.join(
+                f'"{table_name}".{col} IS DISTINCT FROM EXCLUDED.{col}' for col in update_columns
+            )
+            conflict_action = f'DO UPDATE SET {update_str} WHERE {where_str}'
+        else:
+            conflict_action = 'DO NOTHING'
+        stage_table = "bulk_upsert_stage"
+
+        async def upsert(connection):
+            async with connection.transaction():
+                # 暫存表只取用到的欄位與型別，不帶限制條件與預設值；交易結束自動刪除
+                await connection.execute(
+                    f'CREATE TEMP TABLE {stage_table} ON COMMIT DROP AS '
+                    f'SELECT {col_str} FROM "{table_name}" WITH NO DATA'
+                )
+                await connection.copy_records_to_table(stage_table, records=list(records.values()), columns=columns)
+                result = await connection.execute(
+                    f'INSERT INTO "{table_name}" ({col_str}) SELECT {col_str} FROM {stage_table} '
+                    f'ON CONFLICT ({conflict_str}) {conflict_action}'
+                )
+                return int(result.split()[-1])
+
+        return await self._execute(upsert)
+
+    @track_db
     async def delete_db(self, table_name: str, condition: dict):
         """ 
         刪除資料 
@@ -355,16 +798,15 @@ class ApplianceDB:
         :return: 被刪除的資料（dict 格式）。若無符合條件的資料，將拋出 ValueError。
         :raises ValueError: 若找不到符合條件的資料，則操作失敗。
         """
-        await self.check_db_connection()
-        async with self.db_pool.acquire() as connection:
-            condition_clause = ' AND '.join(f"{key} = ${i+1}" for i, key in enumerate(condition.keys()))
-            sql_cmd = f'DELETE FROM "{table_name}" WHERE {condition_clause} RETURNING *'
-            result = await connection.fetchrow(sql_cmd, *condition.values())
-            if not result:
-                raise ValueError(f"Operation failed on {table_name}, possibly due to missing matching records.")
-            
-            return dict(result) if result else None
+        condition_clause = ' AND '.join(f"{key} = ${i+1}" for i, key in enumerate(condition.keys()))
+        sql_cmd = f'DELETE FROM "{table_name}" WHERE {condition_clause} RETURNING *'
+        result = await self._execute(lambda connection: connection.fetchrow(sql_cmd, *condition.values()))
+        if not result:
+            raise ValueError(f"Operation failed on {table_name}, possibly due to missing matching records.")
+
+        return dict(result) if result else None
     
+    @track_db
     async def drop_table(self, table_name: str):
         """
         刪除資料表
@@ -372,8 +814,184 @@ class ApplianceDB:
         :return: None
         :raises Exception: 執行 DROP TABLE 發生錯誤時會拋出例外。
         """
-        await self.check_db_connection()
-
         sql_cmd = f'DROP TABLE IF EXISTS "{table_name}"'
-        async with self.db_pool.acquire() as connection:
-            await connection.execute(sql_cmd)
+        await self._execute(lambda connection: self._execute_and_notify(connection, sql_cmd, f"drop:{table_name}"),
+                            retry=True)
+
+    async def sendlog_partitions_exist(self, sendtask_uuids: list[str]) -> dict[str, bool]:
+        """
+        以一次查詢檢查多個任務的 sendlog 分區是否存在（已 detach 的不算）
+        :param sendtask_uuids: sendtask 的 UUID 列表
+        :return: {sendtask_uuid: 是否存在}
+        """
+        partitions = {sendlog_partition(uuid): uuid for uuid in sendtask_uuids}
+        exists = await self.tables_exist(list(partitions), parent=SENDLOG_TABLE)
+        return {uuid: exists[partition] for partition, uuid in partitions.items()}
+
+    async def sendlog_partition_exists(self, sendtask_uuid: str) -> bool:
+        """
+        檢查任務的 sendlog 分區是否存在（且仍掛在 sendlog 底下，已 detach 的不算）
+        :param sendtask_uuid: sendtask 的 UUID
+        """
+        return (await self.sendlog_partitions_exist([sendtask_uuid]))[sendtask_uuid]
+
+    @track_db
+    async def create_sendlog_partitions(self, sendtask_uuids: list[str]):
+        """
+        在同一個交易內建立多個任務的 sendlog 分區，並通知 loginapp 的任務登錄表
+        :param sendtask_uuids: sendtask 的 UUID 列表
+        """
+        if not sendtask_uuids:
+            return
+        statements = [
+            (f'CREATE TABLE IF NOT EXISTS "{sendlog_partition(uuid)}" PARTITION OF {SENDLOG_TABLE} '
+             f"FOR VALUES IN ('{uuid}')", uuid)
+            for uuid in sendtask_uuids
+        ]
+
+        async def create(connection):
+            async with connection.transaction():
+                for sql_cmd, uuid in statements:
+                    await connection.execute(sql_cmd)
+                    await connection.execute("SELECT pg_notify($1, $2)", TABLE_CHANNEL, f"create:{uuid}")
+
+        await self._execute(create, retry=True)
+        logger.info("Created %d sendlog partitions.", len(statements))
+
+    async def create_sendlog_partition(self, sendtask_uuid: str):
+        """
+        建立任務的 sendlog 分區，並通知 loginapp 的任務登錄表
+        :param sendtask_uuid: sendtask 的 UUID
+        """
+        await self.create_sendlog_partitions([sendtask_uuid])
+
+    @track_db
+    async def detach_sendlog_partition(self, sendtask_uuid: str, archive: bool = None):
+        """
+        把任務的 sendlog 分區從 sendlog 卸下，只改 catalog，不需搬移或逐筆刪除資料
+        :param sendtask_uuid: sendtask 的 UUID
+        :param archive: True 時移到 sendlog_archive schema 保留，False 時直接刪除；
+                        None 依 SENDLOG_ARCHIVE_ON_REMOVE 設定。
+        """
+        partition = sendlog_partition(sendtask_uuid)
+        archive = SENDLOG_ARCHIVE_ON_REMOVE if archive is None else archive
+
+        async def detach(connection):
+            async with connection.transaction():
+                if not await connection.fetchval(SENDLOG_ATTACHED_SQL, SENDLOG_TABLE, partition):
+                    return False
+                await connection.execute(f'ALTER TABLE {SENDLOG_TABLE} DETACH PARTITION "{partition}"')
+                if archive:
+                    await connection.execute(f'DROP TABLE IF EXISTS {SENDLOG_ARCHIVE_SCHEMA}."{partition}"')
+                    await connection.execute(f'ALTER TABLE "{partition}" SET SCHEMA {SENDLOG_ARCHIVE_SCHEMA}')
+                else:
+                    await connection.execute(f'DROP TABLE "{partition}"')
+                await connection.execute("SELECT pg_notify($1, $2)", TABLE_CHANNEL, f"drop:{sendtask_uuid}")
+                return True
+
+        if await self._execute(detach, retry=True):
+            self.count_cache.invalidate(SENDLOG_TABLE, sendtask_uuid)
+            logger.info("Sendlog partition `%s` %s.", partition, "archived" if archive else "dropped")
+
+    @track_db
+    async def find_sendlog_recipients(self, email_fragment: str, owner_gids: list[str] = None,
+                                      sendtask_uuids: list[str] = None, limit: int = 50) -> list[dict]:
+        """
+        跨所有任務搜尋收件者 email，走 target_email 的 trigram 索引，不需逐一掃描各任務
+        :param email_fragment: email 的片段（不分大小寫）。
+        :param owner_gids: 若提供，只搜尋 sendtask_owner_gid 與其有交集的任務。
+        :param sendtask_uuids: 若提供，只搜尋這些任務。
+        :param limit: 最多回傳筆數，依寄送時間由新到舊。
+        :return: 收件者資料列表，含任務 uuid、任務名稱、寄送狀態（status，分類同 SENDLOG_RESULT_CONDITIONS）與觸發狀態。
+        """
+        params = [contains_pattern(email_fragment), limit]
+        owner_sql = ""
+        if owner_gids is not None:
+            params.append(owner_gids)
+            owner_sql += f"AND t.sendtask_owner_gid && ${len(params)}::TEXT[] "
+        if sendtask_uuids is not None:
+            params.append(sendtask_uuids)
+            owner_sql += f"AND s.sendtask_uuid = ANY(${len(params)}::TEXT[]) "
+        sql_cmd = (
+            "SELECT s.sendtask_uuid, t.sendtask_id, s.uuid, s.target_email, s.plan_time, s.send_time, "
+            f"{sendlog_status_sql()} AS status, "
+            "array_length(s.access_time, 1) > 0 AS accessed, "
+            "array_length(s.click_time, 1) > 0 AS clicked, "
+            "array_length(s.file_time, 1) > 0 AS filed "
+            f'FROM {SENDLOG_TABLE} s JOIN sendtasks t ON t.sendtask_uuid = s.sendtask_uuid '
+            f"WHERE s.target_email ILIKE $1 {owner_sql}"
+            "ORDER BY s.send_time DESC NULLS LAST, s.id DESC LIMIT $2"
+        )
+        result = await self._execute(lambda connection: connection.fetch(sql_cmd, *params), retry=True)
+        return [dict(row) for row in result]
+
+    @track_db
+    async def missing_sendlog_indexes(self) -> dict[str, list[str]]:
+        """
+        檢查 SENDLOG_INDEXES 是否都已建立且有效
+        :return: {資料表名稱: [缺少或無效的索引名稱]}，sendlog 本身缺少的索引列在 "sendlog" 下；全部齊全時為空 dict。
+        """
+        names = list(SENDLOG_INDEXES)
+
+        async def check(connection):
+            parents = await connection.fetch(
+                "SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE i.indrelid = $1::regclass AND c.relname = ANY($2::TEXT[])", SENDLOG_TABLE, names
+            )
+            # 每個分區應有一個掛在對應父索引底下的有效索引
+            partitions = await connection.fetch(
+                "SELECT p.relname AS partition, pi.relname AS index_name "
+                "FROM pg_inherits pt JOIN pg_class p ON p.oid = pt.inhrelid "
+                "JOIN pg_index x ON x.indrelid = $1::regclass JOIN pg_class pi ON pi.oid = x.indexrelid "
+                "WHERE pt.inhparent = $1::regclass AND pi.relname = ANY($2::TEXT[]) "
+                "AND NOT EXISTS (SELECT FROM pg_inherits ii JOIN pg_index ci ON ci.indexrelid = ii.inhrelid "
+                "WHERE ii.inhparent = pi.oid AND ci.indrelid = p.oid AND ci.indisvalid) "
+                "ORDER BY p.relname, pi.relname", SENDLOG_TABLE, names
+            )
+            return parents, partitions
+
+        parents, partitions = await self._execute(check, retry=True)
+        valid = {row["relname"] for row in parents if row["indisvalid"]}
+        missing = {}
+        if len(valid) < len(names):
+            missing[SENDLOG_TABLE] = [name for name in names if name not in valid]
+        for row in partitions:
+            missing.setdefault(row["partition"], []).append(row["index_name"])
+        return missing
+
+    async def build_sendlog_indexes(self) -> dict[str, list[str]]:
+        """
+        替已存在的 sendlog 分區補上缺少的索引：CREATE INDEX CONCURRENTLY 後 ATTACH 到父索引。
+        不在交易內執行，建立期間不會擋住寫入；所有分區都掛上後父索引才會變成有效。
+        先前中斷而留下的無效索引會先刪除再重建。
+        :return: {分區名稱: [建立的索引名稱]}
+        """
+        missing = await self.missing_sendlog_indexes()
+        missing.pop(SENDLOG_TABLE, None)
+        built = {}
+        for partition, index_names in missing.items():
+            for name in index_names:
+                # 例如 sendlog_<uuid>_plan_time，超過 63 字元時 Postgres 也會截斷，這裡先截斷以便比對
+                child = f"{partition}_{name.removeprefix(SENDLOG_TABLE + '_').removesuffix('_idx')}"[:63]
+
+                async def build(connection):
+                    invalid = await connection.fetchval(
+                        "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                        "WHERE c.relname = $1 AND c.relnamespace = current_schema()::regnamespace", child
+                    )
+                    if invalid:
+                        await connection.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{child}"')
+                    await connection.execute(
+                        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{child}" ON "{partition}" {SENDLOG_INDEXES[name]}'
+                    )
+                    await connection.execute(f'ALTER INDEX {name} ATTACH PARTITION "{child}"')
+
+                start = time.perf_counter()
+                try:
+                    await self._execute(build)
+                except asyncpg.exceptions.PostgresError as e:
+                    logger.error(f"Failed to build index {child} on {partition}: {e}")
+                    continue
+                built.setdefault(partition, []).append(child)
+                logger.info("Built index %s in %.2fs", child, time.perf_counter() - start)
+        return built
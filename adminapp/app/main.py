@@ -12,11 +12,14 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import asyncio
 
 
-from app.core.db_controller import ApplianceDB
+from app.core.db_controller import ApplianceDB, SENDLOG_TABLE
 from app.services.getSe2data import get_se2_data
 from app.services.db_user import DBUser
 from app.services.get_token import get_token
 from app.services.log_manager import Logger
+from app.services.scheduler_lock import scheduler_lock
+from app.services.sendlog_migration import migrate_tables
+from app.services import metrics
 
 
 # 引入分離的路由模組
@@ -26,18 +29,28 @@ from frontend.src.api.user_api import get_router as user_router
 
 db = ApplianceDB()
 db_user = DBUser(db=db)
-logger = Logger().get_logger()
+logger = Logger().get_logger(__name__)
+scheduler = None
+# 背景補建 sendlog 分區索引的 task
+index_task = None
+# 啟動時是否在背景補建既有分區缺少的索引；設為 false 則改用 sendlog_migration --build-indexes 手動建立
+SENDLOG_BUILD_INDEXES = os.getenv("SENDLOG_BUILD_INDEXES", "true").lower() == "true"
+# 沒拿到排程鎖的 worker 多久重試一次（秒）
+SCHEDULER_LOCK_RETRY = int(os.getenv("SCHEDULER_LOCK_RETRY", 30))
 
 # 定義定時任務
+@metrics.track_job
 async def refresh_token_job():
     logger.info("refresh_token_job 執行")
     await get_token.refresh()
 
+@metrics.track_job
 async def refresh_sendlog_stats_job():
     logger.info("refresh_sendlog_stats_job 執行")
     # 刷新所有 sendlog_stats 資料
     await db_user.refresh_sendlog_stats()
 
+@metrics.track_job
 async def check_sendtasks_job():
     """
     定時執行 check_sendtasks 任務
@@ -90,8 +103,8 @@ async def check_sendtasks_job():
                 await db.delete_db(table_name="sendtasks", condition={"sendtask_uuid": uuid})
                 # sendlog_stats 刪除資料
                 await db.delete_db(table_name="sendlog_stats", condition={"sendtask_uuid": uuid})
-                # 刪除table
-                await db.drop_table(table_name=uuid)
+                # 卸下 sendlog 分區（依 SENDLOG_ARCHIVE_ON_REMOVE 封存或刪除）
+                await db.detach_sendlog_partition(uuid)
             logger.info(f"刪除了 {len(removed_list)} 個任務")
 
         logger.info(f"check_sendtasks_job 完成 - 新增: {len(added_list)}, 刪除: {len(removed_list)}")
@@ -99,7 +112,17 @@ async def check_sendtasks_job():
     except Exception as e:
         logger.error(f"check_sendtasks_job 執行失敗: {str(e)}")
 
+@metrics.track_job
+async def build_sendlog_indexes_job():
+    """ 在交易外逐一補建 sendlog 分區的索引，建立期間不會擋住寫入 """
+    try:
+        built = await db.build_sendlog_indexes()
+        logger.info(f"sendlog 索引補建完成: {sum(len(names) for names in built.values())} 個")
+    except Exception as e:
+        logger.error(f"sendlog 索引補建失敗: {e}")
+
 def start_scheduler():
+    global scheduler
     scheduler = AsyncIOScheduler(timezone=ZoneInfo("Asia/Taipei"))  # 重點：設定時區
     logger.info(f"目前排程使用時區：{scheduler.timezone}")
 
@@ -132,22 +155,85 @@ def start_scheduler():
     logger.info("refresh_sendlog_stats_job 已排程在每日 01:00 執行")
     logger.info("check_sendtasks_job 已排程在每日 01:05 執行")
 
-# 引入資料庫
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    await db.db_init()
+async def initialize_leader():
+    """ 拿到排程鎖的 worker：初始化 token 與資料表後啟動 APScheduler """
+    global index_task
     await refresh_token_job()   # 測試初始化 token
+    # 舊的「每個任務一張資料表」先搬進 sendlog 分區（保留原表），loginapp 的登錄表與寫入才找得到這些任務
+    migrated = await migrate_tables(db)
+    if migrated:
+        logger.info("舊任務資料表搬移結果: %s", migrated)
     await db_user.table_initialize()
     logger.info("資料庫初始化完成")
+    try:
+        missing_indexes = await db.missing_sendlog_indexes()
+        if missing_indexes:
+            logger.warning("sendlog 缺少索引: %s", missing_indexes)
+            if SENDLOG_BUILD_INDEXES and set(missing_indexes) - {SENDLOG_TABLE}:
+                index_task = asyncio.create_task(build_sendlog_indexes_job())
+    except Exception as e:
+        logger.warning(f"無法檢查 sendlog 索引: {e}")
     start_scheduler()  # 啟動 APScheduler
+
+async def run_scheduler_when_leader():
+    """
+    多 worker 時只有拿到排程鎖的 worker 會初始化資料並啟動 APScheduler，
+    其他 worker 定期重試，負責排程的 worker 被回收後由其他 worker 接手。
+    初始化失敗時釋放排程鎖，稍後再重試（也可能由其他 worker 接手）。
+    """
+    while True:
+        if scheduler_lock.acquire():
+            try:
+                await initialize_leader()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"排程初始化失敗，釋放排程鎖，{SCHEDULER_LOCK_RETRY} 秒後重試")
+                scheduler_lock.release()
+        await asyncio.sleep(SCHEDULER_LOCK_RETRY)
+
+# 引入資料庫
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.db_init()
+    leader_task = None
+    if int(os.getenv("WEB_WORKERS", 1)) > 1:
+        # 多 worker：在背景爭取排程鎖，不擋住啟動；
+        # 初始 token 與資料表同步在背景完成，這段期間 worker 已開始接收請求
+        leader_task = asyncio.create_task(run_scheduler_when_leader())
+    else:
+        # 單一 worker：與原本相同，初始化完成後才開始服務，失敗時直接啟動失敗
+        scheduler_lock.acquire()
+        await initialize_leader()
     yield
+    if leader_task is not None:
+        leader_task.cancel()
+        try:
+            await leader_task
+        except asyncio.CancelledError:
+            pass
+    if index_task is not None and not index_task.done():
+        # 中斷的 CONCURRENTLY 建立會留下無效索引，下次補建時會先刪除再重建
+        index_task.cancel()
+        try:
+            await index_task
+        except asyncio.CancelledError:
+            pass
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=False)
+    scheduler_lock.release()
     await db.db_close()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.register_pool_gauges(db)
 
 # 註冊路由
 app.include_router(log_router(db, db_user), prefix="/api")
 app.include_router(user_router(db, db_user), prefix="/api")
+# /metrics 需在前端靜態檔案掛載到 "/" 之前註冊
+app.include_router(metrics.router)
 
 # 設定模板目錄：掛載 React 打包好的靜態檔案（注意路徑）
 FRONTEND_DIST = Path(__file__).resolve().parent.parent / "frontend" / "dist"
@@ -10,14 +10,14 @@ import json
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
-from app.services.log_manager import Logger
+from app.services.log_manager import Logger, timelog
 from app.services.getSe2data import get_se2_data
-from app.core.db_controller import ApplianceDB
+from app.core.db_controller import ApplianceDB, SENDLOG_TABLE
 from app.core.security import verify_password
 from app.core.security import hash_password
 
 
-logger = Logger().get_logger()
+logger = Logger().get_logger(__name__)
 
 def timestamp():
     tz = ZoneInfo("Asia/Taipei")   # 修改時區
@@ -94,19 +94,12 @@ class DBUser:
         self.sendtasks_columns = ["sendtask_uuid", "sendtask_id", "sendtask_owner_gid", "person_count",
                                   "pre_test_end_ut", "pre_test_start_ut", "pre_send_end_ut", "sendtask_create_ut", 
                                   "test_end_ut", "test_start_ut", "is_pause", "stop_time_new"]
-        # sendlog 資料表結構
-        self.sendlog_table_info = {"id": "SERIAL PRIMARY KEY", "uuid": "TEXT UNIQUE", "target_email": "TEXT", 
-                                   "template_uuid": "TEXT", "qrcode_access_active": "TEXT[]", "qrcode_access_ip": "TEXT[]",
-                                   "qrcode_access_time": "BIGINT[]", "person_info": "TEXT", "plan_time": "BIGINT",
-                                   "send_time": "BIGINT", "send_res": "TEXT", "access_time": "BIGINT[]",
-                                   "access_src": "TEXT[]", "access_dev": "TEXT[]", "click_time": "BIGINT[]",
-                                   "click_src": "TEXT[]", "click_dev": "TEXT[]", "file_time": "BIGINT[]",
-                                   "file_src": "TEXT[]", "file_dev": "TEXT[]"}
         # sendlog 欄位
         self.sendlog_columns = ["uuid", "target_email", "person_info", "template_uuid", "plan_time",
                                 "send_time", "send_res", "access_time", "access_src", "access_dev",
                                 "click_time", "click_src", "click_dev", "file_time", "file_src", "file_dev"]
         
+    @timelog
     async def table_initialize(self):
         """
         初始化資料表
@@ -137,7 +130,8 @@ class DBUser:
                     sendtask_uuids = [t["sendtask_uuid"] for t in sendtask_data]
                     # 開始更新sendlog_stats table
                     sendlog_stats_status = await self.refresh_sendlog_stats(sendtask_uuids)
-                    logger.info(f"Updated sendlog_stats with status: {sendlog_stats_status}")
+                    logger.info("Updated sendlog_stats for %d tasks", len(sendlog_stats_status))
+                    logger.debug("sendlog_stats status: %s", sendlog_stats_status)
                     continue
 
                 if not se2_list:
@@ -166,6 +160,7 @@ class DBUser:
             return acct_list
         return []
 
+    @timelog
     async def get_se2_sendtasks(self, column_names=None, days=15) -> list[dict]:
         """
         從 SE2 獲取 sendtasks 資料
@@ -220,6 +215,7 @@ class DBUser:
             return mtmpl_list
         return []
     
+    @timelog
     async def get_se2_sendlog(self, sendtask_uuid: str, sendlog_columns=None) -> list[dict]:
         """
         從 SE2 獲取 sendlog 資料
@@ -235,6 +231,7 @@ class DBUser:
         return []
 
 ## sendtask 相關操作
+    @timelog
     async def refresh_today_create_task(self):
         start_ts, end_ts = timestamp()
         logger.info(f"start_ts: {start_ts}")
@@ -261,32 +258,31 @@ class DBUser:
         return []
 
 ## sendlog and sendlog_stats相關操作
+    @timelog
     async def check_sendlog(self, sendtask_uuids: list):
         """
-        檢查 sendlog table 是否存在於資料庫中
+        檢查任務的 sendlog 分區是否存在於資料庫中
         不存在便新建，並存入資料
         存在則更新資料
         :param sendtask_uuid: sendtask 的 UUID
         """
         await self.db.check_db_connection()
-        logger.info("Checking sendlog tables...")
-        # 批次檢查所有資料表是否存在
-        tables_to_create = []
-        for uuid in sendtask_uuids:
-            if not await self.db.table_exists(uuid):
-                tables_to_create.append(uuid)
-        # 批次建立資料表
-        for uuid in tables_to_create:
-            await self.db.create_table(uuid, self.sendlog_table_info)
-            logger.info(f"Table {uuid} created.")
-        if not tables_to_create:
-            logger.info("All sendlog tables already exist.")  
+        logger.info("Checking sendlog partitions...")
+        # 一次查詢檢查所有分區是否存在
+        exists = await self.db.sendlog_partitions_exist(sendtask_uuids)
+        partitions_to_create = [uuid for uuid, found in exists.items() if not found]
+        # 缺少的分區在同一個交易內建立
+        await self.db.create_sendlog_partitions(partitions_to_create)
+        if not partitions_to_create:
+            logger.info("All sendlog partitions already exist.")  
 
         logger.info("Upserting sendlog tables...")
         sendlog_status = await self.sendlog_write(sendtask_uuids)
-        logger.info(f"Sendlog tables upserted with status: {sendlog_status}")
+        logger.info("Sendlog tables upserted for %d tasks", len(sendlog_status))
+        logger.debug("Sendlog upsert status: %s", sendlog_status)
         return sendlog_status  # 返回狀態而不是 None
 
+    @timelog
     async def sendlog_write(self, sendtask_uuid: list, sendlog_type="test") -> dict:
         """ 
         更新 sendlog 資料到資料庫
@@ -299,16 +295,20 @@ class DBUser:
             # 獲取 sendlog 資料
             sendlog = await self.get_se2_sendlog(uuid, sendlog_columns=self.sendlog_columns)
             if sendlog:
-                sendlog_status[uuid] = "unchanged"
-                for log in sendlog:
-                    status = await self.db.upsert_db(uuid, log, conflict_keys=["uuid"])
-                    if status == "changed":
-                        sendlog_status[uuid] = "changed"
+                # 整個任務一次 COPY + upsert，只有內容變動的資料列會被更新
+                changed = await self.db.bulk_upsert_db(SENDLOG_TABLE, [{"sendtask_uuid": uuid, **log} for log in sendlog],
+                                                       conflict_keys=["sendtask_uuid", "uuid"])
+                sendlog_status[uuid] = "changed" if changed else "unchanged"
+                if changed:
+                    # 任務的 sendlog 有變動，清除該任務的總筆數快取
+                    self.db.count_cache.invalidate(SENDLOG_TABLE, uuid)
+                logger.debug("Sendlog %s: %d of %d rows changed", uuid, changed, len(sendlog))
             else:
                 logger.warning(f"No valid columns found in sendlog for task {uuid}")
 
         return sendlog_status
 
+    @timelog
     async def refresh_sendlog_stats(self, uuids: list[str] = None) -> dict:
         """
         刷新 sendlog_stats 資料
@@ -321,28 +321,53 @@ class DBUser:
             sendtask_data = await self.db.get_db("sendtasks", select_columns=["sendtask_uuid"])
             uuids = [task["sendtask_uuid"] for task in sendtask_data]
         else:
-            logger.info(f"Refreshing sendlog_stats for specified uuids: {uuids}")
+            logger.info("Refreshing sendlog_stats for %d specified uuids", len(uuids))
+            logger.debug("Specified uuids: %s", uuids)
 
         # 確保 sendlog 資料表存在並且為最新狀態
         await self.check_sendlog(uuids)
         # 開始刷新 sendlog_stats
         sendlog_stats_status = {}
         for uuid in uuids:
-            logger.info(f"Refreshing sendlog_stats for {uuid}")
-            data = await self.get_sendlog(table_name=uuid, need_id=False)
+            logger.debug("Refreshing sendlog_stats for %s", uuid)
+            data = await self.get_sendlog(uuid, need_id=False)
             stats = calc_stats(data)
             sendlog_stats_status[uuid] = await self.db.upsert_db("sendlog_stats", {
                 "sendtask_uuid": uuid,
                 **stats
             }, conflict_keys=["sendtask_uuid"])
-            logger.info(f"Updated sendlog_stats for {uuid}. Status: {sendlog_stats_status[uuid]}")
-        logger.info(f"Finished refreshing sendlog_stats.")
+            logger.debug("Updated sendlog_stats for %s. Status: %s", uuid, sendlog_stats_status[uuid])
+        logger.info("Finished refreshing sendlog_stats for %d tasks.", len(sendlog_stats_status))
 
         return sendlog_stats_status
 
-    async def get_sendlog(self, table_name: str, need_id=True):
+    @timelog
+    async def find_recipient(self, email_fragment: str, owner_gids: list[str] = None,
+                             sendtask_uuids: list[str] = None, limit: int = 50) -> list[dict]:
+        """
+        跨所有任務搜尋收件者
+        :param email_fragment: email 的片段，至少 3 個字元才能使用 trigram 索引
+        :param owner_gids: 只搜尋這些組織的任務，None 表示不限制
+        :param sendtask_uuids: 只搜尋這些任務，None 表示不限制
+        :param limit: 最多回傳筆數
+        :return: [{sendtask_uuid, sendtask_id, uuid, target_email, plan_time, send_time, status, accessed, clicked, filed}, ...]
+        """
+        rows = await self.db.find_sendlog_recipients(email_fragment, owner_gids=owner_gids,
+                                                     sendtask_uuids=sendtask_uuids, limit=limit)
+        for row in rows:
+            for col in ("accessed", "clicked", "filed"):
+                row[col] = bool(row[col])
+        return rows
+
+    @timelog
+    async def get_sendlog(self, sendtask_uuid: str, need_id=True):
+        """
+        取得任務的所有 sendlog
+        :param sendtask_uuid: sendtask 的 UUID
+        :param need_id: 是否保留 id 欄位
+        """
         await self.db.check_db_connection()
-        data = await self.db.get_db(table_name)
+        data = await self.db.get_db(SENDLOG_TABLE, where_column="sendtask_uuid", values=sendtask_uuid)
         if not need_id:
             for dd in data:
                 dd.pop("id", None)
@@ -14,11 +14,16 @@ import pandas as pd
 import asyncio
 import httpx
 
+from urllib.parse import urlparse
+
 from app.services.log_manager import Logger
 from app.services.get_token import get_token
+from app.services import metrics
 
 
-logger = Logger().get_logger()
+logger = Logger().get_logger(__name__)
+se2_request_duration = metrics.histogram("se2_request_duration_seconds", "SE2 API call latency",
+                                         ("endpoint", "outcome"))
 
 class getSe2data:
     def __init__(self):
@@ -41,14 +46,19 @@ class getSe2data:
     async def send_post(self, url: str, payload: dict, isTokenRefreshed=False) -> dict | None:
         '''發送 POST 請求'''
         async with httpx.AsyncClient(timeout=60.0, verify=self.verify) as client:
+            endpoint = urlparse(url).path
+            start = time.perf_counter()
             try:
                 response = await client.post(url, headers=self.headers, json=payload)
                 response.raise_for_status() # 如果 HTTP 回應的狀態碼不是 2xx（例如 400、401、500 等），就自動拋出一個錯誤
                 data = response.json()
+                se2_request_duration.observe(time.perf_counter() - start, endpoint, "ok")
                 return data
             except httpx.RequestError as exc:
+                se2_request_duration.observe(time.perf_counter() - start, endpoint, "request_error")
                 logger.error(f"HTTP error occurred: {exc}")
             except Exception as e:
+                se2_request_duration.observe(time.perf_counter() - start, endpoint, "error")
                 if not isTokenRefreshed:
                     # 嘗試重新從txt獲取 token 並重試
                     logger.info("Token expired, re-getting token and retrying...")
@@ -81,7 +91,7 @@ class getSe2data:
                 break
 
             page += 1
-        logger.info(f"Total items fetched: {len(all_data)}")
+        logger.debug("Total items fetched: %d", len(all_data))
         return all_data
 
     async def get_sendtasks(self, end_time=None, start_time=None, filter_time_range=0) -> pd.DataFrame | None:
@@ -135,7 +145,7 @@ class getSe2data:
     async def get_sendlog(self, uuid: str) -> pd.DataFrame | None:
         '''抓取專案參與人員清單'''
         # 要發送 POST 的目標網址
-        logger.info(f"Fetching sendlog for sendtask {uuid}...")
+        logger.debug("Fetching sendlog for sendtask %s...", uuid)
         url = self.url + '/api/case/get_sendlog'
         payload_template = {
                             "sendtask_uuid": uuid,
@@ -6,7 +6,7 @@ from app.services.log_manager import Logger
 import os
 
 
-logger = Logger().get_logger()
+logger = Logger().get_logger(__name__)
 
 class getToken:
     """
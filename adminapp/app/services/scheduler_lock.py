@@ -0,0 +1,51 @@
+'''
+多 worker 時確保 APScheduler 只在一個 worker 內執行。
+
+以檔案鎖（flock）選出負責排程的 worker：程序結束時作業系統會自動釋放鎖，
+被回收的 worker 釋放後，其他 worker 重試時即可接手。
+'''
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，只會以單一 worker 執行
+    fcntl = None
+
+from app.services.log_manager import Logger
+
+
+logger = Logger().get_logger(__name__)
+
+class SchedulerLock:
+    def __init__(self, lock_path: str = None):
+        self.lock_path = lock_path or os.getenv("SCHEDULER_LOCK_FILE", "/tmp/adminapp-scheduler.lock")
+        self._file = None
+
+    def acquire(self) -> bool:
+        """
+        嘗試取得排程鎖（不等待）
+
+        :return: 是否取得（或已持有）排程鎖
+        """
+        if self._file is not None or fcntl is None:
+            return True
+        lock_file = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        logger.info(f"Worker {os.getpid()} acquired the scheduler lock")
+        return True
+
+    def release(self):
+        """ 釋放排程鎖 """
+        if self._file is None:
+            return
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+scheduler_lock = SchedulerLock()
@@ -0,0 +1,189 @@
+'''
+把舊的「每個 sendtask 一張資料表」搬到 sendlog 分區表。
+
+每個舊資料表在一個交易內處理（先取得與建表相同的 advisory lock，不與啟動中的 worker 互相衝突）：
+    1. 建立（或沿用）任務的分區 sendlog_<sendtask_uuid>
+    2. INSERT ... SELECT 把資料搬進分區；check_sendlog 可能已先把 SE2 的資料寫進分區，
+       已存在的 (sendtask_uuid, uuid) 會把舊資料表的 qrcode_access_* 接在現有紀錄之前（只有 loginapp 有這些紀錄）。
+       已合併過的資料列不會重複合併，可重複執行
+    3. 加上 --drop 時，確認舊資料表的每一筆都已寫入或合併後才刪除舊資料表，否則整個任務回復
+完成後會發出與建立分區相同的 NOTIFY，loginapp 的任務登錄表會即時更新。
+
+adminapp 負責排程的 worker 啟動時會在 table_initialize 之前自動執行一次（不刪除舊資料表）。
+loginapp 只認得 sendlog 的分區，部署時需先更新 adminapp、等啟動時的搬移完成後再更新 loginapp。
+
+在 adminapp 目錄下執行：
+    python -m app.services.sendlog_migration              # 搬移所有舊資料表，保留原表
+    python -m app.services.sendlog_migration --dry-run    # 只列出會搬移的資料表
+    python -m app.services.sendlog_migration --drop       # 搬移成功後刪除原表
+    python -m app.services.sendlog_migration <uuid> ...   # 只搬移指定任務
+    python -m app.services.sendlog_migration --build-indexes   # 搬移後在交易外補建既有分區缺少的索引
+'''
+import re
+import time
+import asyncio
+import argparse
+
+from app.core.db_controller import ApplianceDB, SENDLOG_TABLE, TABLE_CHANNEL, sendlog_partition
+from app.services.log_manager import Logger
+
+
+logger = Logger().get_logger(__name__)
+
+# 舊的任務資料表以 sendtask uuid 命名
+LEGACY_TABLE_PATTERN = re.compile(r'^[a-zA-Z0-9_-]{32,36}$')
+# 只有 loginapp 會寫入、SE2 沒有的欄位，搬移時與分區內的現有紀錄合併
+ACCESS_COLUMNS = ("qrcode_access_active", "qrcode_access_ip", "qrcode_access_time")
+
+def _merged(column: str, legacy: str, current: str) -> str:
+    """ current 的 column 是否已以 legacy 的 column 開頭（舊紀錄為空也視為已合併） """
+    return (f'(COALESCE(cardinality({legacy}."{column}"), 0) = 0 OR '
+            f'COALESCE({current}."{column}"[1:cardinality({legacy}."{column}")] = {legacy}."{column}", FALSE))')
+
+async def legacy_tables(db: ApplianceDB) -> list[str]:
+    """ 目前 schema 內以 sendtask uuid 命名、且不是 sendlog 分區的舊資料表 """
+    rows = await db._execute(lambda connection: connection.fetch(
+        "SELECT c.relname FROM pg_class c "
+        "WHERE c.relnamespace = current_schema()::regnamespace AND c.relkind = 'r' AND NOT c.relispartition "
+        "ORDER BY c.relname"
+    ), retry=True)
+    return [row["relname"] for row in rows if LEGACY_TABLE_PATTERN.match(row["relname"])]
+
+async def migrate_table(db: ApplianceDB, sendtask_uuid: str, drop: bool = False) -> int:
+    """
+    把單一舊資料表搬進 sendlog 分區
+
+    :param db: ApplianceDB 實例。
+    :param sendtask_uuid: sendtask uuid（舊資料表名稱）。
+    :param drop: 搬移成功後是否刪除舊資料表。
+    :return: 新寫入或合併的筆數。
+    :raises RuntimeError: drop=True 但舊資料表有資料列未寫入也未合併（整個任務回復，不刪除舊資料表）。
+    """
+    partition = sendlog_partition(sendtask_uuid)
+
+    async def migrate(connection):
+        async with connection.transaction():
+            await connection.execute("SELECT pg_advisory_xact_lock(hashtext('adminapp_schema'))")
+            # 只搬兩邊都有的欄位；舊資料表的 id 不沿用，由 sendlog 重新編號（依原 id 順序寫入）
+            rows = await connection.fetch(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = $1", sendtask_uuid
+            )
+            target = await connection.fetch(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = $1", SENDLOG_TABLE
+            )
+            target_columns = {row["column_name"] for row in target}
+            columns = [row["column_name"] for row in rows
+                       if row["column_name"] in target_columns and row["column_name"] not in ("id", "sendtask_uuid")]
+            col_str = ", ".join(f'"{col}"' for col in columns)
+            access_columns = [col for col in ACCESS_COLUMNS if col in columns]
+
+            await connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{partition}" PARTITION OF {SENDLOG_TABLE} '
+                f"FOR VALUES IN ('{sendtask_uuid}')"
+            )
+            # 已存在的資料列：舊紀錄接在現有紀錄之前；已合併過（現有紀錄以舊紀錄開頭）就不再更新
+            if access_columns:
+                set_sql = ", ".join(
+                    f'"{col}" = CASE WHEN {_merged(col, "EXCLUDED", "s")} THEN s."{col}" '
+                    f'ELSE array_cat(EXCLUDED."{col}", s."{col}") END'
+                    for col in access_columns
+                )
+                pending_sql = " OR ".join(f"NOT {_merged(col, 'EXCLUDED', 's')}" for col in access_columns)
+                conflict_sql = f"DO UPDATE SET {set_sql} WHERE {pending_sql}"
+            else:
+                conflict_sql = "DO NOTHING"
+            # 同一個 uuid 重複出現時只取最新一筆（同一列在一個 INSERT 內只能更新一次）
+            result = await connection.execute(
+                f'INSERT INTO {SENDLOG_TABLE} AS s (sendtask_uuid, {col_str}) '
+                f'SELECT $1, {col_str} FROM ('
+                f'SELECT DISTINCT ON (uuid) * FROM "{sendtask_uuid}" WHERE uuid IS NOT NULL ORDER BY uuid, id DESC'
+                f') legacy ORDER BY id '
+                f'ON CONFLICT (sendtask_uuid, uuid) {conflict_sql}',
+                sendtask_uuid
+            )
+            if drop:
+                # 舊資料表的每一筆都要能在分區內找到，且 qrcode_access_* 已合併
+                merged_sql = " AND ".join([_merged(col, "l", "s") for col in access_columns] or ["TRUE"])
+                legacy_count = await connection.fetchval(f'SELECT COUNT(*) FROM "{sendtask_uuid}"')
+                migrated_count = await connection.fetchval(
+                    f'SELECT COUNT(*) FROM "{sendtask_uuid}" l JOIN {SENDLOG_TABLE} s '
+                    f'ON s.sendtask_uuid = $1 AND s.uuid = l.uuid WHERE {merged_sql}', sendtask_uuid
+                )
+                if migrated_count != legacy_count:
+                    raise RuntimeError(f"{legacy_count - migrated_count} of {legacy_count} legacy rows "
+                                       "were not migrated; keeping the legacy table")
+                await connection.execute(f'DROP TABLE "{sendtask_uuid}"')
+            await connection.execute("SELECT pg_notify($1, $2)", TABLE_CHANNEL, f"create:{sendtask_uuid}")
+            return int(result.split()[-1])
+
+    return await db._execute(migrate)
+
+async def migrate_tables(db: ApplianceDB, sendtask_uuids: list[str] = None, drop: bool = False) -> dict:
+    """
+    以已初始化的 ApplianceDB 搬移舊資料表，單一任務失敗不影響其他任務
+
+    :param db: ApplianceDB 實例。
+    :param sendtask_uuids: 指定要搬移的任務，None 表示所有舊資料表。
+    :param drop: 搬移成功後是否刪除舊資料表。
+    :return: {sendtask_uuid: 新寫入或合併的筆數}，失敗的任務為錯誤訊息。
+    """
+    tables = await legacy_tables(db)
+    if sendtask_uuids:
+        tables = [table for table in tables if table in set(sendtask_uuids)]
+    result = {}
+    for table in tables:
+        start = time.perf_counter()
+        try:
+            result[table] = await migrate_table(db, table, drop=drop)
+            logger.info("Migrated %s: %d rows in %.2fs", table, result[table], time.perf_counter() - start)
+        except Exception as e:
+            logger.error(f"Failed to migrate {table}: {e}")
+            result[table] = f"error: {e}"
+    return result
+
+async def migrate(sendtask_uuids: list[str] = None, drop: bool = False, dry_run: bool = False,
+                  build_indexes: bool = False) -> dict:
+    """
+    搬移舊資料表
+
+    :param sendtask_uuids: 指定要搬移的任務，None 表示所有舊資料表。
+    :param drop: 搬移成功後是否刪除舊資料表。
+    :param dry_run: 只列出會搬移的資料表。
+    :param build_indexes: 搬移後以 CREATE INDEX CONCURRENTLY 補建既有分區缺少的索引。
+    :return: {sendtask_uuid: 新寫入或合併的筆數}，失敗的任務為錯誤訊息。
+    """
+    db = ApplianceDB()
+    # db_init 會依 table_info.sql 建立 sendlog 分區表
+    await db.db_init()
+    try:
+        if dry_run:
+            tables = await legacy_tables(db)
+            if sendtask_uuids:
+                tables = [table for table in tables if table in set(sendtask_uuids)]
+            return {table: "pending" for table in tables}
+
+        result = await migrate_tables(db, sendtask_uuids, drop=drop)
+        if build_indexes:
+            for partition, indexes in (await db.build_sendlog_indexes()).items():
+                result[partition] = f"indexes: {', '.join(indexes)}"
+        return result
+    finally:
+        await db.db_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate per-sendtask tables into the partitioned sendlog table")
+    parser.add_argument("sendtask_uuids", nargs="*", help="only migrate these sendtasks")
+    parser.add_argument("--drop", action="store_true", help="drop each legacy table after it is migrated")
+    parser.add_argument("--dry-run", action="store_true", help="list the tables that would be migrated")
+    parser.add_argument("--build-indexes", action="store_true",
+                        help="build missing sendlog partition indexes concurrently after migrating")
+    args = parser.parse_args()
+    result = asyncio.run(migrate(args.sendtask_uuids or None, drop=args.drop, dry_run=args.dry_run,
+                                 build_indexes=args.build_indexes))
+    for table, status in result.items():
+        print(f"{table}\t{status}")
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ Created on Thu May  8 14:32:44 2025
 
 用api到se2系統抓取資料
 """
-from fastapi import APIRouter, Request, Body, Depends
+from fastapi import APIRouter, Request, Body, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
@@ -19,6 +19,7 @@ import zipfile
 
 from app.services.log_manager import Logger
 from app.services.getSe2data import get_se2_data
+from app.core.db_controller import SENDLOG_TABLE, SENDLOG_RESULT_CONDITIONS, contains_pattern
 from app.core.security import verify_password
 from app.core.security import hash_password
 from frontend.src.api.user_api import get_current_user
@@ -61,7 +62,7 @@ def get_router(db, db_user):
     """
     # router = APIRouter()
     router = APIRouter(dependencies=[Depends(get_current_user)])
-    logger = Logger().get_logger()
+    logger = Logger().get_logger(__name__)
 
     ## sendtasks 相關的 API
     class OrgsRequest(BaseModel):
@@ -137,8 +138,8 @@ def get_router(db, db_user):
                 await db.delete_db(table_name="sendtasks", condition={"sendtask_uuid": uuid})
                 # sendlog_stats 刪除資料
                 await db.delete_db(table_name="sendlog_stats", condition={"sendtask_uuid": uuid})
-                # 刪除table
-                await db.drop_table(table_name=uuid)
+                # 卸下 sendlog 分區（依 SENDLOG_ARCHIVE_ON_REMOVE 封存或刪除）
+                await db.detach_sendlog_partition(uuid)
 
 
             data = {"added": added_list, "removed": removed_list, "sendlog_stats_status": sendlog_stats_status}
@@ -263,6 +264,10 @@ def get_router(db, db_user):
         sort: str = "desc"
         sortBy: str = "plan_time"
         paginate: bool = True
+        # keyset 分頁：第一頁傳空字串，之後傳回上一頁的 next_cursor；None 則依 page 用 OFFSET 分頁
+        cursor: str | None = None
+        # 沒有其他篩選條件時，以 planner 估計值代替精確的總筆數
+        estimateCount: bool = False
 
     async def _query_sendlog_details(request: GetSendlogDetailRequest):
         """
@@ -271,14 +276,15 @@ def get_router(db, db_user):
         if not request.sendtask_uuid:
             raise ValueError("沒有收到 sendtask_uuid")
 
-        where_clauses = []
-        params = []
-        param_idx = 1
+        # 先以 sendtask_uuid 篩選，只掃描該任務的分區
+        where_clauses = ["sendtask_uuid = $1"]
+        params = [request.sendtask_uuid]
+        param_idx = 2
 
-        # 搜尋文字
+        # 搜尋文字（target_email、person_info 各有 trigram 索引）
         if request.searchText:
             where_clauses.append(f"(target_email ILIKE ${param_idx} OR person_info ILIKE ${param_idx})")
-            params.append(f"%{request.searchText}%")
+            params.append(contains_pattern(request.searchText))
             param_idx += 1
 
         # 日期範圍篩選 (send_time)
@@ -304,16 +310,8 @@ def get_router(db, db_user):
                 pass # 忽略無效的日期格式
 
         # 寄送狀態
-        if request.resultType == 'notyet':
-            where_clauses.append("(send_time IS NULL OR send_time = 0)")
-        elif request.resultType == 'send':
-            where_clauses.append("(send_time IS NOT NULL AND send_time > 0 AND send_res IS NOT NULL AND send_res ILIKE '%True%')")
-        elif request.resultType == 'failed':
-            where_clauses.append("(send_time IS NOT NULL AND send_time > 0 AND send_res IS NOT NULL AND send_res ILIKE '%False%')")
-        elif request.resultType == 'not_triggered':
-            where_clauses.append("(send_time IS NOT NULL AND send_time > 0 AND send_res IS NOT NULL AND send_res ILIKE '%True%' AND array_length(access_time, 1) IS NULL)")
-        elif request.resultType == 'triggered':
-            where_clauses.append("array_length(access_time, 1) > 0")
+        if request.resultType in SENDLOG_RESULT_CONDITIONS:
+            where_clauses.append(SENDLOG_RESULT_CONDITIONS[request.resultType])
 
         # 行為過濾
         if request.showAccessed:
@@ -337,13 +335,16 @@ def get_router(db, db_user):
         order_by = f"{sort_map.get(request.sortBy, "plan_time DESC")} {sort.get(request.sort, "DESC")}"
 
         result = await db.get_paginated_db(
-            table_name=request.sendtask_uuid,
+            table_name=SENDLOG_TABLE,
             paginate=request.paginate,
             page=request.page,
             rows_per_page=request.rowsPerPage,
             where_clauses=where_clauses,
             params=params,
-            order_by=order_by
+            order_by=order_by,
+            cursor=request.cursor,
+            # 只有任務本身的條件（沒有搜尋、篩選）時估計值才準確
+            estimate_count=request.estimateCount and len(where_clauses) == 1
         )
 
         # 處理觸發紀錄，只留最後一筆
@@ -370,13 +371,58 @@ def get_router(db, db_user):
             if not result['data']:
                 return {"status": "error", "message": "沒有符合條件的資料", "data": [], "total_count": 0}
             
-            return {"status": "success", "data": result['data'], "total_count": result['total_count']}
+            return {"status": "success", "data": result['data'], "total_count": result['total_count'],
+                    "total_count_approximate": result['total_count_estimated'], "next_cursor": result['next_cursor']}
         except Exception as e:
             logger.error(f"Error in get_sendlog_detail for {request.sendtask_uuid}: {str(e)}")
             if "does not exist" in str(e):
                 return {"status": "error", "message": f"找不到任務 {request.sendtask_uuid} 的日誌資料表。", "data": [], "total_count": 0}
             return {"status": "error", "message": str(e), "data": [], "total_count": 0}
 
+    class FindRecipientRequest(BaseModel):
+        email: str
+        limit: int = 50
+
+    async def _recipient_scope(user: dict) -> dict:
+        """
+        依登入者決定可搜尋的範圍（不採用前端傳入的組織）
+        :return: find_recipient 的篩選參數；admin 不限制，一般使用者限自己的組織，客戶限自己的任務
+        """
+        user_type = user.get("user_type")
+        if user_type == "admin":
+            return {}
+        if user_type == "user":
+            users = await db.get_db("users", where_column="username", values=user.get("username"))
+            return {"owner_gids": (users[0].get("orgs") or []) if users else []}
+        if user_type == "customer":
+            customers = await db.get_db("customer_accts", where_column="customer_name", values=user.get("username"))
+            return {"sendtask_uuids": (customers[0].get("sendtask_uuids") or []) if customers else []}
+        raise HTTPException(status_code=403, detail="無效的使用者類型")
+
+    @router.post("/find_recipient")
+    async def find_recipient(request: FindRecipientRequest, user: dict = Depends(get_current_user)):
+        """
+        跨所有任務搜尋收件者 email，範圍依登入者的身分決定
+
+        1.  POST /find_recipient
+        2.  Body: {"email": "alice@", "limit": 50}
+        3.  Response: {"status": "success", "data": [{"sendtask_uuid", "sendtask_id", "uuid", "target_email", "status", ...}]}
+        """
+        email = request.email.strip()
+        # trigram 索引至少需要 3 個字元
+        if len(email) < 3:
+            return {"status": "error", "message": "請至少輸入 3 個字元", "data": []}
+        scope = await _recipient_scope(user)
+        if any(not values for values in scope.values()):
+            # 沒有任何組織或任務，不需查詢
+            return {"status": "success", "data": []}
+        try:
+            data = await db_user.find_recipient(email, limit=max(1, min(request.limit, 500)), **scope)
+            return {"status": "success", "data": data}
+        except Exception as e:
+            logger.error(f"Error in find_recipient: {str(e)}")
+            return {"status": "error", "message": str(e), "data": []}
+
     class DownloadSendlogRequest(GetSendlogDetailRequest):
         sendtask_uuid: str
         selected_uuids: list[str] | None = None
@@ -400,11 +446,13 @@ def get_router(db, db_user):
         """
         try:
             if request.selected_uuids:
-                all_data = await db.get_db(
-                    table_name=request.sendtask_uuid,
-                    where_column="uuid",
-                    values=request.selected_uuids
+                result = await db.get_paginated_db(
+                    table_name=SENDLOG_TABLE,
+                    paginate=False,
+                    where_clauses=["sendtask_uuid = $1", "uuid = ANY($2::TEXT[])"],
+                    params=[request.sendtask_uuid, request.selected_uuids]
                 )
+                all_data = result.get('data', [])
             else:
                 result = await _query_sendlog_details(request)
                 all_data = result.get('data', [])
@@ -10,10 +10,10 @@ from pydantic import BaseModel
 from app.core.security import verify_password
 from app.core.security import hash_password
 from app.core.security import create_access_token
-from app.services.log_manager import Logger
+from app.services.log_manager import Logger, timelog_stats
 from jose import jwt, JWTError
 
-logger = Logger().get_logger()
+logger = Logger().get_logger(__name__)
 
 # Load environment variables from .env file
 env_path = Path(__file__).parent.parent.parent.parent.parent / ".env"
@@ -40,6 +40,12 @@ async def get_current_user(request: Request):
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Token 無效")
 
+async def get_admin_user(user: dict = Depends(get_current_user)):
+    """ 僅允許管理員帳號 """
+    if user.get("user_type") != "admin":
+        raise HTTPException(status_code=403, detail="需要管理員權限")
+    return user
+
 def get_router(db, db_user):
     """
     Initializes the user API router.
@@ -254,4 +260,26 @@ def get_router(db, db_user):
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"更新密碼時發生錯誤: {str(e)}")
 
+    # timelog 統計（僅管理員）
+    @router.get("/admin/timelog", dependencies=[Depends(get_admin_user)])
+    async def get_timelog_stats():
+        """
+        各個 @timelog 函式的呼叫次數與耗時分位數（秒），僅為處理本次請求的 worker 的統計
+        """
+        return {"status": "success", "pid": os.getpid(), "data": timelog_stats.snapshot()}
+
+    @router.delete("/admin/timelog", dependencies=[Depends(get_admin_user)])
+    async def reset_timelog_stats():
+        timelog_stats.reset()
+        return {"status": "success"}
+
+    # sendlog 索引檢查（僅管理員）
+    @router.get("/admin/sendlog_indexes", dependencies=[Depends(get_admin_user)])
+    async def check_sendlog_indexes():
+        """
+        列出 sendlog 及各分區缺少或無效的索引，data 為空表示索引齊全
+        """
+        missing = await db.missing_sendlog_indexes()
+        return {"status": "success" if not missing else "warning", "data": missing}
+
     return router
@@ -154,6 +154,7 @@ export default function TaskDetail({ task, open, onClose }) {
   const [isAsc, setIsAsc] = useState(false); // false for 'desc', true for 'asc'
   const [downloading, setDownloading] = useState(false);
   const [selectAllAcrossPages, setSelectAllAcrossPages] = useState(false); // 是否選取所有頁面所有資料
+  const [pageCursors, setPageCursors] = useState({}); // 各頁的 keyset cursor，依序翻頁時不必用 OFFSET
 
 
   // 篩選條件
@@ -171,16 +172,23 @@ export default function TaskDetail({ task, open, onClose }) {
   });
 
   // 載入任務詳細資料
-  const fetchTaskLogs = async () => {
+  const fetchTaskLogs = async ({ reset = false } = {}) => {
     if (!task?.sendtask_uuid) return;
 
+    // 重新查詢時從第一頁開始，舊的 cursor 都不再適用
+    const currentPage = reset ? 0 : page;
+    const cursors = reset ? {} : pageCursors;
+    if (reset) setPageCursors({});
+
     try {
       setLoading(true);
       setError(null);
       // 獲取詳細日誌 (帶上所有參數)
       const response = await axios.post("/api/get_sendlog_detail", { 
         sendtask_uuid: task.sendtask_uuid,
-        page: page + 1, // 後端頁碼從 1 開始
+        page: currentPage + 1, // 後端頁碼從 1 開始
+        // 有上一頁留下的 cursor 就用 keyset 分頁，直接跳頁則用 page
+        cursor: cursors[currentPage] ?? (currentPage === 0 ? "" : null),
         ...filters 
       });
 
@@ -188,6 +196,9 @@ export default function TaskDetail({ task, open, onClose }) {
       if (logsResult.status === "success") {
         setLogs(logsResult.data || []);
         setTotalLogs(logsResult.total_count || 0);
+        if (logsResult.next_cursor) {
+          setPageCursors(prev => ({ ...prev, [currentPage + 1]: logsResult.next_cursor }));
+        }
       } else {
         throw new Error(logsResult.message || "獲取日誌資料失敗");
       }
@@ -210,6 +221,7 @@ export default function TaskDetail({ task, open, onClose }) {
         setLogs([]);
         setTotalLogs(0);
         setPage(0);
+        setPageCursors({});
         setTaskData(null);
 
         try {
@@ -249,6 +261,7 @@ export default function TaskDetail({ task, open, onClose }) {
       setLogs([]);
       setTaskData(null);
       setPage(0);
+      setPageCursors({});
       setFilters({
         searchText:'',
         dateFrom: '',
@@ -305,6 +318,11 @@ export default function TaskDetail({ task, open, onClose }) {
     }
   };
 
+  // 任何篩選、排序或每頁筆數改變後，舊的 cursor 都不再適用
+  useEffect(() => {
+    setPageCursors({});
+  }, [filters]);
+
   const handleChangePage = (event, newPage) => {
     setPage(newPage);
   };
@@ -544,7 +562,7 @@ export default function TaskDetail({ task, open, onClose }) {
                             setPage(0);
                             setSelectedUuids([]);
                             setSelectAllAcrossPages(false);
-                            fetchTaskLogs();
+                            fetchTaskLogs({ reset: true });
                           }}>
                             查詢
                         </Button>
@@ -1,13 +1,42 @@
+import os
 import uvicorn
 
 # 儲存logger
 from app.services.log_manager import Logger, timelog
 logger = Logger(enable_console=True, enable_file=True).get_logger()
 
+def server_options() -> dict:
+    """
+    正式環境（APP_ENV=production）的 uvicorn 參數，皆可由環境變數調整：
+        WEB_WORKERS           worker 數（預設 CPU 核心數）
+        WEB_KEEPALIVE         keep-alive 秒數（預設 5）
+        WEB_BACKLOG           等待中的連線上限（預設 2048）
+        WEB_MAX_REQUESTS      每個 worker 處理幾個請求後回收重啟，0 為不回收（預設 0）
+        WEB_MAX_REQUESTS_JITTER  回收門檻的隨機偏移，避免 worker 同時重啟（預設 0）
+        WEB_GRACEFUL_TIMEOUT  關閉時等待進行中請求的秒數（預設 30）
+    """
+    workers = int(os.getenv("WEB_WORKERS", os.cpu_count() or 1))
+    # 讓各 worker 的連線池依 worker 數分配資料庫連線
+    os.environ["WEB_WORKERS"] = str(workers)
+    max_requests = int(os.getenv("WEB_MAX_REQUESTS", 0))
+    return {
+        "workers": workers,
+        "timeout_keep_alive": int(os.getenv("WEB_KEEPALIVE", 5)),
+        "backlog": int(os.getenv("WEB_BACKLOG", 2048)),
+        "limit_max_requests": max_requests or None,
+        "limit_max_requests_jitter": int(os.getenv("WEB_MAX_REQUESTS_JITTER", 0)),
+        "timeout_graceful_shutdown": int(os.getenv("WEB_GRACEFUL_TIMEOUT", 30)),
+    }
+
 @timelog
 def main():
-    logger.debug('host="0.0.0.0", port=8080, reload=True')
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8080, reload=True)
+    if os.getenv("APP_ENV", "development") == "production":
+        options = server_options()
+        logger.debug(f'host="0.0.0.0", port=8080, {options}')
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8080, **options)
+    else:
+        logger.debug('host="0.0.0.0", port=8080, reload=True')
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8080, reload=True)
 
 if __name__ == "__main__":
     main()
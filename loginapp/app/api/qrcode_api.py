@@ -1,12 +1,22 @@
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+import os
+from fastapi import APIRouter, Request, Query
+from fastapi.responses import Response, FileResponse
 from urllib.parse import urljoin
 from urllib.parse import urlencode
 from app.services.qrcode import qrcode
+from app.services.qrcode_cache import qrcode_cache
+from app.services.render_pool import render_pool, RenderPoolBusy
+from app.services.qrcode_store import qrcode_store
 
 
 router = APIRouter()
 
+# 同一個網址產生的圖片永遠相同，允許瀏覽器與代理長期快取
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 支援的圖片格式：png1 = 1-bit PNG（預設）、png = 24-bit RGB PNG、svg
+MEDIA_TYPES = {"png1": "image/png", "png": "image/png", "svg": "image/svg+xml"}
+QRCODE_MAX_SCALE = int(os.getenv("QRCODE_MAX_SCALE", 40))
+
 '''組合qrcode網址'''
 def creat_qrcode_url(logintype, uuid):
     # 寫死主網址
@@ -20,9 +30,66 @@ def creat_qrcode_url(logintype, uuid):
 
     return url
 
+def negotiate_format(accept: str) -> str:
+    """
+    依 Accept 標頭選擇格式：只有 SVG 的權重明確高於 PNG 時才回傳 SVG。
+    多數郵件用戶端不顯示 SVG，瀏覽器的 Accept 雖然列了 image/svg+xml，仍以 PNG 為主。
+    """
+    weights = {}
+    for item in accept.split(","):
+        media_type, *params = (part.strip() for part in item.split(";"))
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        weights[media_type.lower()] = q
+
+    def weight(media_type: str) -> float:
+        for candidate in (media_type, media_type.split("/")[0] + "/*", "*/*"):
+            if candidate in weights:
+                return weights[candidate]
+        return 0.0
+
+    svg, png = weight("image/svg+xml"), weight("image/png")
+    return "svg" if svg > png else "png1"
+
 @router.get("/{logintype}/uuid")
-async def project_qrcode_image(logintype: str, uuid: str = None):
+async def project_qrcode_image(request: Request, logintype: str, uuid: str = None,
+                               fmt: str = Query(None, alias="format", pattern="^(svg|png1|png)$"),
+                               scale: int = Query(None, ge=1, le=QRCODE_MAX_SCALE)):
+    scale = scale or qrcode.scale
+    headers = {"Cache-Control": CACHE_CONTROL}
+    if fmt is None:
+        # 沒有指定格式時依 Accept 決定，快取需依 Accept 區分
+        fmt = negotiate_format(request.headers.get("accept", ""))
+        headers["Vary"] = "Accept"
+
     url = creat_qrcode_url(logintype, uuid)
-    img_io = qrcode.output(url)
+    # ETag 由繪製輸入決定，快取、檔案庫、即時繪製三種來源都一致
+    digest = qrcode_store.digest(url, scale, fmt)
+    etag = f'"{digest[:32]}"'
+    headers["ETag"] = etag
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
 
-    return StreamingResponse(img_io, media_type="image/png")
\ No newline at end of file
+    media_type = MEDIA_TYPES[fmt]
+    key = (logintype, uuid, scale, fmt)
+    entry = qrcode_cache.get(key)
+    if entry is None:
+        # 預先產生過的圖片直接回傳檔案
+        path = qrcode_store.lookup(digest)
+        if path is not None:
+            return FileResponse(path, media_type=media_type, headers=headers)
+        try:
+            data = await render_pool.render(url, scale, fmt)
+        except RenderPoolBusy:
+            # 繪製排隊已滿，請用戶端稍後再試，避免拖慢其他請求
+            return Response("QR code renderer is busy", status_code=503, media_type="text/plain",
+                            headers={"Retry-After": "1"})
+        entry = qrcode_cache.put(key, data, etag)
+    data, _ = entry
+    return Response(data, media_type=media_type, headers=headers)
@@ -1,34 +1,35 @@
+import uuid
 from pydantic import BaseModel
 from datetime import datetime
 from dotenv import load_dotenv
 import os
-from fastapi import Request, APIRouter
+from fastapi import Request, APIRouter, HTTPException
 
-from app.core.db_controller import db
+from app.services.event_queue import event_queue
+from app.services.task_registry import task_registry
+from app.services.visit_dedup import visit_dedup
 from app.services.log_manager import Logger
 
 
-logger = Logger().get_logger()
+logger = Logger().get_logger(__name__)
 
 LOG_FILE = os.getenv("LOG_FILE", "/data/visit_log.csv")
 router = APIRouter()
 
 async def writer_db(url_id, new_data):
-    table_name = url_id[16:48]
+    task_uuid = url_id[16:48]
     person_uuid = url_id[48:] + url_id[:16]
-
-    # 先取資料
-    column_names = ["access_active", "access_ip", "access_time"]
-    data = await db.get_db(table_name, person_uuid, column_names)
-    data = data[0]
-    logger.debug(f"data: {data}")
-    # 寫入資料
-    for index, dd in enumerate(data):
-        if data[dd] is None: data[dd] = []
-        data[dd].append(new_data[index])
-    logger.debug(f"data: {data}")
-    condition = {"uuid": person_uuid}
-    await db.update_db(table_name, data, condition)
+    # 格式錯誤或不存在的任務直接拒絕，不進資料庫
+    if len(url_id) != 64 or not task_registry.is_known(task_uuid):
+        raise HTTPException(status_code=404, detail="Unknown link")
+    # 時間窗內重複開啟只計數，時間窗結束時由 visit_dedup 補寫一筆 visit_repeat
+    if new_data[0] == "visit" and not await visit_dedup.allow((task_uuid, person_uuid, new_data[1]), new_data[2]):
+        return
+
+    # 放進批次佇列，由背景 flusher 合併寫入；event_id 讓重送的事件不會重複紀錄
+    event = (uuid.uuid4().hex, task_uuid, person_uuid, *new_data)
+    logger.debug("event: %s", event)
+    await event_queue.put(event)
 
 # 進入login後記錄id
 class VisitData(BaseModel):
@@ -1,11 +1,46 @@
+import os
 import re
+import time
+import asyncio
 import asyncpg
 import aiofiles
 
 from app.services.log_manager import Logger
+from app.services.metrics import track_db
 
 
-logger = Logger().get_logger()
+logger = Logger().get_logger(__name__)
+
+# 視為連線中斷、需要 supervisor 檢查連線池的錯誤
+# 單一連線被重置（ConnectionError）時 asyncpg 會自行丟棄那條連線，不列在這裡
+CONNECTION_ERRORS = (
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.AdminShutdownError,
+    asyncpg.exceptions.CrashShutdownError,
+    asyncpg.exceptions.CannotConnectNowError,
+)
+
+def pool_max_size() -> int:
+    """
+    每個 worker 的連線池上限。
+    有設定 DB_POOL_MAX_SIZE 就直接使用；否則把這個 app 可用的 Postgres 連線數
+    DB_MAX_CONNECTIONS（預設 60）平均分給 WEB_WORKERS 個 worker，最多 10 條。
+    """
+    if os.getenv("DB_POOL_MAX_SIZE"):
+        return int(os.getenv("DB_POOL_MAX_SIZE"))
+    budget = int(os.getenv("DB_MAX_CONNECTIONS", 60))
+    workers = int(os.getenv("WEB_WORKERS", 1))
+    return max(1, min(10, budget // workers))
+
+def connection_params() -> dict:
+    """ Postgres 連線參數，連線池與專用的 LISTEN 連線共用 """
+    return {
+        "host": os.getenv("DB_HOST", "postgres-db"),
+        "port": int(os.getenv("DB_PORT", 5432)),
+        "user": os.getenv("DB_USER", "myuser"),
+        "password": os.getenv("DB_PASSWORD", "mypassword"),
+        "database": os.getenv("DB_NAME", "mydatabase"),
+    }
 
 class ApplianceDB:
     def __init__(self):
@@ -14,65 +49,284 @@ class ApplianceDB:
         self.allowed_columns = {
             "sendtasks": {"sendtask_id", "sendtask_uuid", "sendtask_create_ut"}
         }
+        # append-only 事件紀錄表，/api/visit、/api/login 的事件先批次寫入這裡
+        # event_id 由 loginapp 產生，重送同一事件時用來去重
+        self.events_table = "access_events"
+        self.events_columns = ["event_id", "task_uuid", "person_uuid", "access_active", "access_ip", "access_time"]
+        # 所有任務共用的 sendlog 分區表（由 adminapp 建立），依 sendtask_uuid 分區
+        self.sendlog_table = "sendlog"
+        # 附加紀錄陣列的 SQL 對所有任務都相同，asyncpg 在每條連線上只需 prepare 一次
+        # array_cat 遇到 NULL 會直接回傳另一個陣列，不需先補空陣列
+        self.append_sql = (
+            f'UPDATE "{self.sendlog_table}" SET '
+            'qrcode_access_active = array_cat(qrcode_access_active, $3::TEXT[]), '
+            'qrcode_access_ip = array_cat(qrcode_access_ip, $4::TEXT[]), '
+            'qrcode_access_time = array_cat(qrcode_access_time, $5::BIGINT[]) '
+            'WHERE sendtask_uuid = $1 AND uuid = $2 RETURNING id'
+        )
+        # 連線池監控：連線中斷時由 asyncpg 通知，背景 supervisor 確認後重建連線池
+        self.health_interval = float(os.getenv("DB_HEALTH_INTERVAL", 30))
+        self._pool_lock = asyncio.Lock()
+        self._pool_lost = asyncio.Event()
+        self._supervisor = None
+        # 等待取得連線的時間（秒），給壓力測試與監控使用
+        self.pool_wait_count = 0
+        self.pool_wait_total = 0.0
+        self.pool_wait_max = 0.0
+        # 目前正在等待取得連線的數量
+        self.pool_waiting = 0
+
+    async def _create_pool(self):
+        logger.debug("Initializing PostgreSQL connection pool...")
+        return await asyncpg.create_pool(
+            **connection_params(),
+            min_size=1,
+            max_size=pool_max_size(),
+            init=self._init_connection
+        )
+
+    async def _init_connection(self, connection):
+        """ 每條新連線都註冊中斷通知 """
+        connection.add_termination_listener(self._on_connection_terminated)
+
+    def _on_connection_terminated(self, connection):
+        """ 連線關閉時喚醒 supervisor 做一次健康檢查 """
+        self._pool_lost.set()
 
     async def db_init(self):
         if self.db_pool is None:
-            logger.debug("Initializing PostgreSQL connection pool...")
-            self.db_pool = await asyncpg.create_pool(
-                host='postgres-db',
-                port=5432,
-                user='myuser',
-                password='mypassword',
-                database='mydatabase',
-                min_size=1,
-                max_size=10
-            )
+            self.db_pool = await self._create_pool()
+            await self.create_events_table()
+        if self._supervisor is None:
+            self._supervisor = asyncio.create_task(self._supervise())
 
     async def db_close(self):
+        if self._supervisor:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
         if self.db_pool:
             logger.debug("Closing PostgreSQL connection pool...")
             await self.db_pool.close()
             self.db_pool = None
 
     async def check_db_connection(self):
-        """ 檢查資料庫連線，若斷線則重新初始化 """
+        """ 確認連線池已建立；斷線偵測與重建交給背景 supervisor """
         if self.db_pool is None:
-            await self.db_init()
-            return
+            await self._rebuild_pool(None)
+
+    async def _rebuild_pool(self, broken_pool):
+        """
+        重建連線池。多個請求同時發現斷線時只會重建一次。
+
+        :param broken_pool: 發生錯誤時使用的連線池，若已被換掉就不再重建。
+        """
+        async with self._pool_lock:
+            if self.db_pool is not broken_pool:
+                return
+            self.db_pool = None
+            if broken_pool is not None:
+                broken_pool.terminate()
+            self.db_pool = await self._create_pool()
+            logger.info("PostgreSQL connection pool rebuilt.")
+
+    async def _supervise(self):
+        """ 背景監控：連線中斷或每隔 health_interval 秒檢查一次，失敗就重建連線池 """
+        while True:
+            try:
+                await asyncio.wait_for(self._pool_lost.wait(), timeout=self.health_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._pool_lost.clear()
+
+            pool = self.db_pool
+            try:
+                if pool is None:
+                    raise ConnectionError("connection pool is not available")
+                async with pool.acquire() as connection:
+                    await connection.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Database connection lost: {e}. Reinitializing...")
+                try:
+                    await self._rebuild_pool(pool)
+                except Exception as e:
+                    logger.error(f"Failed to rebuild connection pool: {e}")
+
+    async def _execute(self, operation, retry: bool = False):
+        """
+        取一條連線執行 operation(connection)。
+        遇到連線層錯誤時通知 supervisor 檢查連線池（確認失敗才重建，不會中斷其他連線上的查詢）；
+        retry=True（冪等的讀取）時會再試一次。
 
+        :param operation: 接收 connection、回傳 coroutine 的函式。
+        :param retry: 是否在發生連線層錯誤後重試一次。
+        """
+        pool = self.db_pool
+        if pool is None:
+            await self.check_db_connection()
+            pool = self.db_pool
         try:
-            async with self.db_pool.acquire() as connection:
-                await connection.fetch("SELECT 1")
-        except Exception as e:
-            logger.error(f"Database connection lost: {e}. Reinitializing...")
-            await self.db_close()
-            await self.db_init()
-
-    async def get_db(self, table_name: str, person_uuid: str, column_names: list[str] = None) -> list:
+            start = time.perf_counter()
+            self.pool_waiting += 1
+            try:
+                connection = await pool.acquire()
+            finally:
+                self.pool_waiting -= 1
+            self._record_pool_wait(time.perf_counter() - start)
+            try:
+                return await operation(connection)
+            finally:
+                await pool.release(connection)
+        except CONNECTION_ERRORS as e:
+            logger.warning(f"Database connection error: {e}. Checking connection pool...")
+            self._pool_lost.set()
+            if not retry:
+                raise
+        async with (self.db_pool or pool).acquire() as connection:
+            return await operation(connection)
+
+    def _record_pool_wait(self, seconds: float):
+        self.pool_wait_count += 1
+        self.pool_wait_total += seconds
+        self.pool_wait_max = max(self.pool_wait_max, seconds)
+
+    def pool_stats(self) -> dict:
+        """ 連線池目前狀態與累計的等待時間 """
+        pool = self.db_pool
+        return {
+            "size": pool.get_size() if pool else 0,
+            "idle": pool.get_idle_size() if pool else 0,
+            "max_size": pool.get_max_size() if pool else 0,
+            "wait_count": self.pool_wait_count,
+            "wait_avg_ms": round(self.pool_wait_total / self.pool_wait_count * 1000, 3) if self.pool_wait_count else 0.0,
+            "wait_max_ms": round(self.pool_wait_max * 1000, 3),
+        }
+
+    @track_db
+    async def get_db(self, task_uuid: str, person_uuid: str, column_names: list[str] = None) -> list:
         """
-        查詢資料，支援全表查詢、欄位篩選與條件查詢。
+        查詢單一收件者的 sendlog，支援欄位篩選。
         """
-        await self.check_db_connection()
+        # 查詢指定欄位 = 值
+        col_str = ", ".join(column_names) if column_names else "*"
+        sql_cmd = f'SELECT {col_str} FROM "{self.sendlog_table}" WHERE sendtask_uuid = $1 AND uuid = $2'
+        result = await self._execute(lambda connection: connection.fetch(sql_cmd, task_uuid, person_uuid), retry=True)
+        return [dict(row) for row in result] if result else []
 
-        async with self.db_pool.acquire() as connection:
-            # 查詢指定欄位 = 值
-            col_str = ", ".join(column_names)
-            sql_cmd = f'SELECT {col_str} FROM "{table_name}" WHERE uuid = $1'
-            result = await connection.fetch(sql_cmd, person_uuid)
-            return [dict(row) for row in result] if result else []
+    @track_db
+    async def get_person_uuids(self, task_uuid: str) -> list[str]:
+        """
+        取得任務所有收件者的 uuid
+
+        :param task_uuid: sendtask uuid。
+        """
+        sql_cmd = f'SELECT uuid FROM "{self.sendlog_table}" WHERE sendtask_uuid = $1 ORDER BY id'
+        result = await self._execute(lambda connection: connection.fetch(sql_cmd, task_uuid), retry=True)
+        return [row["uuid"] for row in result]
 
+    @track_db
     async def update_db(self, table_name: str, data: dict, condition: dict):
         """ 更新資料 """
-        await self.check_db_connection()
-        async with self.db_pool.acquire() as connection:
-            set_clause = ', '.join(f"{key} = ${i+1}" for i, key in enumerate(data.keys()))
-            condition_clause = ' AND '.join(f"{key} = ${len(data) + i+1}" for i, key in enumerate(condition.keys()))
-            sql_cmd = f'UPDATE "{table_name}" SET {set_clause} WHERE {condition_clause} RETURNING *'
-            result = await connection.fetchrow(sql_cmd, *data.values(), *condition.values())
-            if not result:
-                raise ValueError(f"Operation failed on {table_name}, possibly due to missing matching records.")
-            
-            return dict(result) if result else None
+        set_clause = ', '.join(f"{key} = ${i+1}" for i, key in enumerate(data.keys()))
+        condition_clause = ' AND '.join(f"{key} = ${len(data) + i+1}" for i, key in enumerate(condition.keys()))
+        sql_cmd = f'UPDATE "{table_name}" SET {set_clause} WHERE {condition_clause} RETURNING *'
+        result = await self._execute(lambda connection: connection.fetchrow(sql_cmd, *data.values(), *condition.values()))
+        if not result:
+            raise ValueError(f"Operation failed on {table_name}, possibly due to missing matching records.")
+
+        return dict(result) if result else None
+
+    @track_db
+    async def create_events_table(self):
+        """ 建立 append-only 事件紀錄表 """
+        sql_cmd = (
+            f'CREATE TABLE IF NOT EXISTS "{self.events_table}" ('
+            'id BIGSERIAL PRIMARY KEY, '
+            'event_id TEXT UNIQUE NOT NULL, '
+            'task_uuid TEXT NOT NULL, '
+            'person_uuid TEXT NOT NULL, '
+            'access_active TEXT, '
+            'access_ip TEXT, '
+            'access_time BIGINT, '
+            'create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'
+        )
+
+        async def create(connection):
+            # 多個 worker 同時啟動時，CREATE TABLE IF NOT EXISTS 仍可能互相衝突，先取得鎖再建表
+            async with connection.transaction():
+                await connection.execute("SELECT pg_advisory_xact_lock(hashtext('loginapp_schema'))")
+                await connection.execute(sql_cmd)
+
+        await self._execute(create, retry=True)
+
+    @track_db
+    async def record_events(self, events: list[tuple]) -> int:
+        """
+        在同一個交易內寫入事件紀錄表，並把新事件附加到 sendlog 的紀錄陣列。
+        以 event_id 去重，同一批事件重送（例如 spool 重播）不會重複附加。
+
+        :param events: 事件列表，每筆為 (event_id, task_uuid, person_uuid, access_active, access_ip, access_time)。
+        :return: 實際新寫入的事件數。
+        """
+        if not events:
+            return 0
+        col_str = ", ".join(self.events_columns)
+        # COPY 無法搭配 ON CONFLICT，改用 unnest 一次帶入整批資料
+        sql_cmd = (
+            f'INSERT INTO "{self.events_table}" ({col_str}) '
+            'SELECT * FROM unnest($1::TEXT[], $2::TEXT[], $3::TEXT[], $4::TEXT[], $5::TEXT[], $6::BIGINT[]) '
+            'ON CONFLICT (event_id) DO NOTHING RETURNING event_id'
+        )
+        columns = [list(col) for col in zip(*events)]
+
+        async def record(connection):
+            async with connection.transaction():
+                rows = await connection.fetch(sql_cmd, *columns)
+                new_ids = {row["event_id"] for row in rows}
+
+                # 只附加這次真正寫入的事件，依收件者合併
+                grouped = {}
+                for event_id, task_uuid, person_uuid, *new_data in events:
+                    if event_id in new_ids:
+                        new_ids.discard(event_id)
+                        grouped.setdefault((task_uuid, person_uuid), []).append(tuple(new_data))
+
+                for (task_uuid, person_uuid), new_data in grouped.items():
+                    try:
+                        # savepoint：單一收件者失敗（例如無效連結）不影響整批
+                        async with connection.transaction():
+                            await self._append_access(connection, task_uuid, person_uuid, new_data)
+                    except (ValueError, asyncpg.exceptions.SyntaxOrAccessError, asyncpg.exceptions.DataError) as e:
+                        logger.error(f"Failed to record {len(new_data)} events for {task_uuid}/{person_uuid}: {e}")
+                return len(rows)
+
+        return await self._execute(record, retry=True)
 
+    async def _append_access(self, connection, task_uuid: str, person_uuid: str, events: list[tuple]):
+        """ 在指定連線上附加紀錄陣列，參數同 append_access """
+        actives, ips, times = (list(col) for col in zip(*events))
+
+        result = await connection.fetchval(self.append_sql, task_uuid, person_uuid, actives, ips, times)
+        if result is None:
+            raise ValueError(f"Operation failed on {task_uuid}, possibly due to missing matching records.")
+
+    @track_db
+    async def append_access(self, task_uuid: str, person_uuid: str, events: list[tuple]):
+        """
+        把同一收件者的多筆事件附加到 sendlog 的紀錄陣列。
+        三個陣列在同一個 UPDATE 內完成，同一收件者的並行請求會依序套用，不會互相覆蓋。
+        所有任務共用同一個 SQL，asyncpg 會在每條連線上重用同一個 prepared statement。
+
+        :param task_uuid: sendtask uuid。
+        :param person_uuid: 收件者 uuid。
+        :param events: 事件列表，每筆為 (access_active, access_ip, access_time)。
+        :raises ValueError: 若找不到該收件者。
+        """
+        await self._execute(lambda connection: self._append_access(connection, task_uuid, person_uuid, events))
 
 db = ApplianceDB()
@@ -8,8 +8,15 @@ from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 from app.core.db_controller import db
+from app.services.event_queue import event_queue
+from app.services.template_cache import template_cache
+from app.services.render_pool import render_pool
+from app.services.task_registry import task_registry
+from app.services.visit_dedup import visit_dedup
+from app.services.qrcode_cache import qrcode_cache
+from app.services import metrics
 # 引入分離的路由模組
-from app.routers.login_router import router as login_router
+from app.routers.login_router import router as login_router, LOGIN_TEMPLATES
 from app.api.record_api import router as record_api
 from app.api.qrcode_api import router as qrcode_api
 
@@ -17,12 +24,38 @@ from app.api.qrcode_api import router as qrcode_api
 # 引入資料庫
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    template_cache.load(*LOGIN_TEMPLATES)
     await db.db_init()
+    await task_registry.start()
+    await event_queue.start()
+    await visit_dedup.start()
+    render_pool.start()
     yield
+    render_pool.stop()
+    await visit_dedup.stop()
+    await event_queue.stop()
+    await task_registry.stop()
     await db.db_close()
 
 app = FastAPI(lifespan=lifespan)
 # app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
+
+# 執行期指標：連線池、事件佇列、QR Code 繪製與快取
+metrics.register_pool_gauges(db)
+metrics.gauge("event_queue_depth", "Events waiting in the in-memory queue",
+              callback=lambda: event_queue.queue.qsize() if event_queue.queue else 0)
+metrics.gauge("event_spool_segments", "Closed spool segments waiting for replay",
+              callback=lambda: len(event_queue.spool.segments()))
+metrics.gauge("qrcode_render_pending", "QR renders queued or running", callback=lambda: render_pool.pending)
+metrics.gauge("qrcode_cache_bytes", "Bytes held by the QR image cache", callback=lambda: qrcode_cache.current_bytes)
+metrics.gauge("qrcode_cache_entries", "Images held by the QR image cache", callback=lambda: qrcode_cache.stats()["entries"])
+metrics.counter("qrcode_cache_evictions_total", "QR images evicted from the cache", callback=lambda: qrcode_cache.evictions)
+metrics.counter("qrcode_cache_requests_total", "QR image cache lookups by result", ("result",),
+                callback=lambda: {("hit",): qrcode_cache.hits, ("miss",): qrcode_cache.misses})
+metrics.counter("visit_dedup_coalesced_total", "Repeat visits coalesced", callback=lambda: visit_dedup.coalesced)
+metrics.gauge("task_registry_tasks", "Known sendtask tables (-1 while not loaded)",
+              callback=lambda: len(task_registry.tasks) if task_registry.loaded else -1)
 
 # 掛載靜態文件目錄
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -31,6 +64,7 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 app.include_router(login_router)
 app.include_router(record_api, prefix="/api")
 app.include_router(qrcode_api, prefix="/qrcode")
+app.include_router(metrics.router)
 
 def main():
     import uvicorn
@@ -6,13 +6,17 @@ import os
 from fastapi import FastAPI, Request, APIRouter
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, Response
+from fastapi.responses import HTMLResponse
+
+from app.services.template_cache import template_cache
 
 LOG_FILE = os.getenv("LOG_FILE", "/data/visit_log.csv")
 router = APIRouter()
 
 # 設定模板目錄
 templates = Jinja2Templates(directory="app/templates")
+# 登入頁直接由記憶體快取回應，啟動時預先載入
+LOGIN_TEMPLATES = ("login_test.html", "login_googledrive.html")
 
 @router.get("/")
 async def index(request: Request):
@@ -20,12 +24,8 @@ async def index(request: Request):
 
 @router.get("/login/test/{project_id}", response_class=HTMLResponse)
 async def project_detail(request: Request, project_id: str): 
-    with open("app/templates/login_test.html", "r", encoding="utf-8") as f:
-        content = f.read()
-    return Response(content, media_type="text/html")
+    return template_cache.response(request, "login_test.html")
 
 @router.get("/login/googledrive/{project_id}", response_class=HTMLResponse)
 async def project_detail(request: Request, project_id: str): 
-    with open("app/templates/login_googledrive.html", "r", encoding="utf-8") as f:
-        content = f.read()
-    return Response(content, media_type="text/html")
+    return template_cache.response(request, "login_googledrive.html")
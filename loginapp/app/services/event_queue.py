@@ -0,0 +1,165 @@
+'''
+紀錄事件的批次寫入佇列。
+
+/api/visit、/api/login 只把事件寫進本機 spool、放進記憶體佇列就回應，
+由背景 flusher 定時（或累積到一定數量時）取出一批事件：
+    1. 寫入 append-only 的事件紀錄表
+    2. 依收件者合併後，一次附加到 sendlog 的紀錄陣列
+兩者在同一個交易內完成，並以 event_id 去重。
+
+資料庫異常或佇列滿時，事件只留在 spool，由背景 replay 在資料庫恢復後批次補寫。
+
+可用環境變數調整：
+    EVENT_FLUSH_SIZE       每批最多寫入幾筆（預設 500）
+    EVENT_FLUSH_INTERVAL   最長多久 flush 一次，單位秒（預設 1.0）
+    EVENT_QUEUE_MAX_SIZE   佇列最大深度，滿了就只寫 spool（預設 10000）
+    EVENT_REPLAY_INTERVAL  多久嘗試重播一次 spool，單位秒（預設 5.0）
+'''
+import os
+import asyncio
+
+from app.core.db_controller import db
+from app.services.event_spool import EventSpool
+from app.services.log_manager import Logger
+
+
+logger = Logger().get_logger(__name__)
+
+class EventQueue:
+    def __init__(self, flush_size: int = None, flush_interval: float = None, max_size: int = None,
+                 replay_interval: float = None, spool: EventSpool = None):
+        self.flush_size = flush_size or int(os.getenv("EVENT_FLUSH_SIZE", 500))
+        self.flush_interval = flush_interval or float(os.getenv("EVENT_FLUSH_INTERVAL", 1.0))
+        self.max_size = max_size or int(os.getenv("EVENT_QUEUE_MAX_SIZE", 10000))
+        self.replay_interval = replay_interval or float(os.getenv("EVENT_REPLAY_INTERVAL", 5.0))
+        self.spool = spool or EventSpool()
+        self.queue = None
+        self._task = None
+        self._replay_task = None
+        # 有事件只存在 spool、尚未寫入資料庫
+        self._replay_pending = False
+        self._replaying = False
+
+    async def start(self):
+        """ 啟動背景 flusher 與 replay；上次未寫完的 spool 會先排入重播 """
+        if self._task is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.spool.adopt_orphans()
+        self._replay_pending = bool(self.spool.segments())
+        self._task = asyncio.create_task(self._run())
+        self._replay_task = asyncio.create_task(self._replay_loop())
+        logger.info(f"EventQueue started (flush_size={self.flush_size}, "
+                    f"flush_interval={self.flush_interval}s, max_size={self.max_size})")
+
+    async def stop(self):
+        """ 停止 flusher，並把佇列中剩餘的事件寫完；寫不進去的留在 spool 下次重播 """
+        if self._task is None:
+            return
+        for task in (self._task, self._replay_task):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._replay_task = None
+
+        while not self.queue.empty():
+            await self.flush(self._drain(self.flush_size))
+        self.spool.close()
+        logger.info("EventQueue stopped")
+
+    async def put(self, event: tuple):
+        """
+        放入一筆事件：先寫 spool，再放進記憶體佇列。
+        佇列滿了（或尚未啟動）時事件只留在 spool，之後由 replay 寫入。
+
+        :param event: (event_id, task_uuid, person_uuid, access_active, access_ip, access_time)
+        """
+        self.spool.append(event)
+        if self.queue is None:
+            self._replay_pending = True
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("EventQueue is full, event kept in spool for replay")
+            self._replay_pending = True
+
+    def _drain(self, limit: int) -> list[tuple]:
+        """ 取出佇列中現有的事件，最多 limit 筆 """
+        batch = []
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            # 等第一筆事件進來，再最多等 flush_interval 秒湊滿一批
+            batch = [await self.queue.get()]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.flush_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                batch.extend(self._drain(self.flush_size - len(batch)))
+            await self.flush(batch)
+
+            # spool 中的事件都已寫入資料庫，可以整批清掉
+            if self.queue.empty() and not self._replay_pending and not self._replaying:
+                for segment in self.spool.rotate():
+                    self.spool.remove(segment)
+
+    async def flush(self, batch: list[tuple]) -> bool:
+        """
+        寫入一批事件，失敗時標記為待重播（事件仍在 spool）
+
+        :param batch: 事件列表，每筆為 (event_id, task_uuid, person_uuid, access_active, access_ip, access_time)。
+        :return: 是否寫入成功。
+        """
+        if not batch:
+            return True
+        try:
+            recorded = await db.record_events(batch)
+        except Exception as e:
+            logger.error(f"Failed to record {len(batch)} events, kept in spool for replay: {e}")
+            self._replay_pending = True
+            return False
+        logger.debug("Flushed %d events (%d new)", len(batch), recorded)
+        return True
+
+    async def replay(self) -> bool:
+        """
+        把 spool 中已關閉的 segment 批次寫入資料庫，成功的 segment 才刪除。
+
+        :return: 是否全部重播完成。
+        """
+        # 重播期間若又有事件只進 spool，會重新標記為待重播
+        self._replay_pending = False
+        self._replaying = True
+        try:
+            for segment in self.spool.rotate():
+                events = self.spool.read(segment)
+                for i in range(0, len(events), self.flush_size):
+                    if not await self.flush(events[i:i + self.flush_size]):
+                        return False
+                self.spool.remove(segment)
+                logger.info(f"Replayed {len(events)} events from {segment}")
+            return True
+        finally:
+            self._replaying = False
+
+    async def _replay_loop(self):
+        while True:
+            if self._replay_pending:
+                await self.replay()
+            await asyncio.sleep(self.replay_interval)
+
+
+event_queue = EventQueue()
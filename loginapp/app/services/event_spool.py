@@ -0,0 +1,116 @@
+'''
+紀錄事件的本機 spool（write-ahead buffer）。
+
+每筆事件在放進記憶體佇列前，先以一行 JSON 附加到目前的 segment 檔：
+    - 程序中斷或資料庫異常時事件不會遺失，重啟後由 EventQueue 重播
+    - 重播以 event_id 去重，重複寫入不會造成重複紀錄
+
+檔案路徑可用環境變數 EVENT_SPOOL_DIR 調整（預設 ./data/spool）。
+多 worker 時每個程序各自寫在 EVENT_SPOOL_DIR/<pid>/ 底下，已結束程序留下的檔案由存活的 worker 接手。
+'''
+import os
+import json
+import time
+import shutil
+
+from app.services.log_manager import Logger
+
+
+logger = Logger().get_logger(__name__)
+
+class EventSpool:
+    def __init__(self, spool_dir: str = None):
+        self.base_dir = spool_dir or os.getenv("EVENT_SPOOL_DIR", "./data/spool")
+        self.spool_dir = os.path.join(self.base_dir, str(os.getpid()))
+        self._file = None
+        self._segment = None
+
+    def adopt_orphans(self):
+        """ 把已結束的 worker 留下的 segment 移到自己的目錄，之後一併重播 """
+        if not os.path.isdir(self.base_dir):
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        for name in os.listdir(self.base_dir):
+            path = os.path.join(self.base_dir, name)
+            if not name.isdigit() or path == self.spool_dir or not os.path.isdir(path):
+                continue
+            try:
+                os.kill(int(name), 0)
+                continue  # 程序仍在執行
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+            # 其他 worker 可能同時在接手，已被搬走的檔案直接略過
+            try:
+                for segment in os.listdir(path):
+                    os.rename(os.path.join(path, segment), os.path.join(self.spool_dir, segment))
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"Adopted spool segments from exited worker {name}")
+
+    def _open_segment(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._segment = os.path.join(self.spool_dir, f"events-{time.time_ns()}.spool")
+        self._file = open(self._segment, "a", encoding="utf-8")
+
+    def append(self, event: tuple):
+        """
+        附加一筆事件，寫入作業系統緩衝即返回（不做 fsync）。
+
+        :param event: (event_id, task_uuid, person_uuid, access_active, access_ip, access_time)
+        """
+        if self._file is None:
+            self._open_segment()
+        self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def segments(self) -> list[str]:
+        """ 列出目前寫入中以外的所有 segment，依建立順序排列 """
+        if not os.path.isdir(self.spool_dir):
+            return []
+        names = sorted(
+            (name for name in os.listdir(self.spool_dir) if name.endswith(".spool")),
+            key=lambda name: int(name[len("events-"):-len(".spool")])
+        )
+        paths = [os.path.join(self.spool_dir, name) for name in names]
+        return [path for path in paths if path != self._segment]
+
+    def rotate(self) -> list[str]:
+        """
+        關閉目前的 segment，之後的事件寫入新檔。
+
+        :return: 所有已關閉的 segment。
+        """
+        if self._file is not None and self._file.tell() > 0:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._segment = None
+        return self.segments()
+
+    def read(self, segment: str) -> list[tuple]:
+        """ 讀出 segment 內的事件，略過中斷時寫了一半的最後一行 """
+        events = []
+        with open(segment, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(tuple(json.loads(line)))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupted line in {segment}")
+        return events
+
+    def remove(self, segment: str):
+        """ 刪除已寫入資料庫的 segment """
+        try:
+            os.remove(segment)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._segment = None
@@ -1,8 +1,119 @@
 import os
 import sys
+import copy
+import gzip
+import json
 import time
+import queue
+import atexit
+import random
+import shutil
+import inspect
 import logging
+import threading
+import logging.handlers
+from collections import deque
 from functools import wraps
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，多 worker 時改以 pid 命名
+    fcntl = None
+
+# All module loggers are children of this one, so LOG_LEVELS can target a module or a package.
+ROOT_LOGGER = "app"
+# Attributes every LogRecord has; anything else came from `extra=` and goes into the JSON output.
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "sample_rate"}
+
+def _parse_mapping(value: str) -> dict:
+    """Parse "name=value,name=value" (used by LOG_LEVELS and LOG_SAMPLE_RATES)."""
+    mapping = {}
+    for item in (value or "").split(","):
+        name, sep, setting = item.partition("=")
+        if sep and name.strip():
+            mapping[name.strip()] = setting.strip()
+    return mapping
+
+def _logger_name(name: str) -> str:
+    """Place a module name under ROOT_LOGGER (app.api.record_api stays as is)."""
+    if name == ROOT_LOGGER or name.startswith(ROOT_LOGGER + "."):
+        return name
+    return f"{ROOT_LOGGER}.{name}"
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line (LOG_FORMAT=json).
+
+    Fields passed with `extra=` are added as top-level keys.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "location": f"{record.module}:{record.lineno}",
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of low-severity records from noisy call sites.
+
+    Rates come from LOG_SAMPLE_RATES, e.g. "app.api.record_api=0.01,app.services.event_queue:134=0.1";
+    the most specific match wins (logger:lineno, then the logger, then its parents).
+    A call site can also pass `extra={"sample_rate": 0.01}`. WARNING and above are always kept.
+    """
+
+    def __init__(self, rates: dict = None):
+        super().__init__()
+        self.rates = {_logger_name(name): float(rate) for name, rate in (rates or {}).items()}
+        self._cache = {}
+
+    def rate_for(self, record: logging.LogRecord) -> float:
+        rate = getattr(record, "sample_rate", None)
+        if rate is not None:
+            return rate
+        key = (record.name, record.lineno)
+        if key not in self._cache:
+            rate = self.rates.get(f"{record.name}:{record.lineno}")
+            name = record.name
+            while rate is None and name:
+                rate = self.rates.get(name)
+                name = name.rpartition(".")[0]
+            self._cache[key] = 1.0 if rate is None else rate
+        return self._cache[key]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record)
+        return rate >= 1 or random.random() < rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the exception text separate from the message,
+    so the listener's formatter (text or JSON) decides how to render it."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
 
 class Logger:
@@ -49,53 +160,202 @@ class Logger:
         self._initialized = True
 
         # Create a logger instance.
-        self.logger = logging.getLogger(__name__)
+        self.logger = logging.getLogger(ROOT_LOGGER)
+        self.listener = None
+        self._slot_file = None
 
         if not self.logger.handlers:
-            formatter = logging.Formatter("%(asctime)s-%(levelname)s: %(message)s")
-            self.logger.setLevel(logging.DEBUG)
+            if os.getenv("LOG_FORMAT", "text").lower() == "json":
+                formatter = JsonFormatter()
+            else:
+                formatter = logging.Formatter("%(asctime)s-%(levelname)s: %(message)s")
+            self.logger.setLevel(self._level(os.getenv("LOG_LEVEL", "INFO")))
+            self.logger.propagate = False
+            # Per-logger levels, e.g. LOG_LEVELS="app.api.record_api=WARNING,app.services=DEBUG"
+            for name, level in _parse_mapping(os.getenv("LOG_LEVELS")).items():
+                logging.getLogger(_logger_name(name)).setLevel(self._level(level))
 
+            handlers = []
             # Handler settings for the command line output.
             if self._enable_console_flag:
                 console_handler = logging.StreamHandler(sys.stdout)
                 console_handler.setFormatter(formatter)
-                console_handler.setLevel(logging.DEBUG)  # Set the level of the commandline handler
-                self.logger.addHandler(console_handler)
+                handlers.append(console_handler)
 
-            # Handler settings for file output.
+            # Handler settings for file output: rotated at midnight, old files are gzipped.
             if self._enable_file_flag:
-                curr_date = time.strftime("%Y%m%d")
-                log_path = './Logger'
-                log_name = f'{curr_date}.log'
-                log_file = os.path.join(log_path, log_name)
+                log_path = os.getenv("LOG_DIR", "./Logger")
                 os.makedirs(log_path, exist_ok=True)
-                file_handler = logging.FileHandler(log_file)
-                file_handler.setLevel(logging.DEBUG)  # Set the level of the file handler
+                file_handler = logging.handlers.TimedRotatingFileHandler(
+                    os.path.join(log_path, self._log_name(log_path)),
+                    when=os.getenv("LOG_ROTATE_WHEN", "midnight"),
+                    backupCount=int(os.getenv("LOG_BACKUP_COUNT", 14)),
+                    encoding="utf-8",
+                )
+                file_handler.namer = lambda name: name + ".gz"
+                file_handler.rotator = self._gzip_rotator
                 file_handler.setFormatter(formatter)
-                self.logger.addHandler(file_handler)
+                handlers.append(file_handler)
+
+            # Records are put on a queue and written by a background thread,
+            # so logging never blocks the event loop on console or disk I/O.
+            # Sampled-out records are dropped here, before they are formatted or queued.
+            log_queue = queue.SimpleQueue()
+            queue_handler = _QueueHandler(log_queue)
+            queue_handler.addFilter(SamplingFilter(_parse_mapping(os.getenv("LOG_SAMPLE_RATES"))))
+            self.logger.addHandler(queue_handler)
+            self.listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(self.listener.stop)
+
+    @staticmethod
+    def _level(name: str) -> int:
+        level = logging.getLevelName(name.strip().upper())
+        return level if isinstance(level, int) else logging.INFO
 
-    def get_logger(self) -> logging.Logger:
-        """Get the configured logger instance."""
-        return self.logger
+    def _log_name(self, log_path: str) -> str:
+        """Log file name; each worker gets its own file so rotations do not clash.
 
+        With several workers each process takes the first free slot (app.<slot>.log),
+        held by an flock on app.<slot>.lock until it exits. A respawned or recycled
+        worker reuses the slot, so the file keeps rotating and LOG_BACKUP_COUNT still
+        applies, instead of one file per pid being left behind.
+        """
+        if int(os.getenv("WEB_WORKERS", 1)) <= 1:
+            return "app.log"
+        if fcntl is None:
+            return f"app.{os.getpid()}.log"
+        slot = 0
+        while True:
+            lock_file = open(os.path.join(log_path, f"app.{slot}.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                slot += 1
+                continue
+            # Kept open for the life of the process; the OS releases the lock on exit.
+            self._slot_file = lock_file
+            return f"app.{slot}.log"
+
+    @staticmethod
+    def _gzip_rotator(source: str, dest: str):
+        """Compress the rotated log file and remove the original."""
+        with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+    def get_logger(self, name: str = None) -> logging.Logger:
+        """Get the configured logger instance.
+
+        Args:
+            name (str, optional): Module name (usually `__name__`); returns a child
+                logger so LOG_LEVELS and LOG_SAMPLE_RATES can target it.
+        """
+        if name is None:
+            return self.logger
+        return logging.getLogger(_logger_name(name))
+
+
+class TimelogStats:
+    """In-memory call statistics for functions decorated with `timelog`.
+
+    Keeps a call count, error count and total/max time per function, plus the
+    most recent TIMELOG_SAMPLES durations (default 1000) for percentiles.
+    Statistics are per process; with several workers each keeps its own.
+    """
+
+    def __init__(self, samples: int = None):
+        self.samples = samples or int(os.getenv("TIMELOG_SAMPLES", 1000))
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, elapsed: float, failed: bool = False):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = {"count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                                            "durations": deque(maxlen=self.samples)}
+            stat["count"] += 1
+            stat["errors"] += failed
+            stat["total"] += elapsed
+            stat["max"] = max(stat["max"], elapsed)
+            stat["durations"].append(elapsed)
+
+    @staticmethod
+    def _percentile(ordered: list, pct: float) -> float:
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+    def snapshot(self) -> dict:
+        """Return {function name: stats} with times in seconds, slowest total first."""
+        with self._lock:
+            items = [(name, dict(stat, durations=sorted(stat["durations"]))) for name, stat in self._stats.items()]
+        result = {}
+        for name, stat in sorted(items, key=lambda item: item[1]["total"], reverse=True):
+            ordered = stat["durations"]
+            result[name] = {
+                "count": stat["count"],
+                "errors": stat["errors"],
+                "total": round(stat["total"], 6),
+                "mean": round(stat["total"] / stat["count"], 6),
+                "max": round(stat["max"], 6),
+                "p50": round(self._percentile(ordered, 50), 6),
+                "p95": round(self._percentile(ordered, 95), 6),
+                "p99": round(self._percentile(ordered, 99), 6),
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+timelog_stats = TimelogStats()
 
 def timelog(func):
-    """Decorator that logs the execution time of a function.
+    """Decorator that logs and aggregates the execution time of a function.
+
+    Works on both regular functions and coroutine functions. START/END lines
+    are written at DEBUG level; every call is also recorded in `timelog_stats`.
     Args:
         func (Callable): The function to wrap.
     Returns:
         Callable: The wrapped function with execution time logging. 
     """
+    name = func.__qualname__
+
+    def finish(start_time: float, failed: bool):
+        execution_time = time.perf_counter() - start_time
+        timelog_stats.record(name, execution_time, failed)
+        Logger().get_logger().debug("[Phase: %s] ------------- END in %.3f(s)", name, execution_time)
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            Logger().get_logger().debug("[Phase: %s] ------------- START", name)
+            start_time = time.perf_counter()
+            failed = True
+            try:
+                result = await func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                finish(start_time, failed)
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        logger = Logger().get_logger()
-        logger.info(f'[Phase: {func.__name__}] ------------- START')
-        start_time = time.time()
+        Logger().get_logger().debug("[Phase: %s] ------------- START", name)
+        start_time = time.perf_counter()
+        failed = True
         try:
-            return func(*args, **kwargs)
+            result = func(*args, **kwargs)
+            failed = False
+            return result
         finally:
-            execution_time = time.time() - start_time
-            logger.info(f"[Phase: {func.__name__}] ------------- END in {execution_time:.3f}(s)")
+            finish(start_time, failed)
     return wrapper
 
 
@@ -112,3 +372,4 @@ if __name__ == "__main__":
     logger.debug("Start")
     example("Hello World!!")
     logger.debug("End")
+    print(timelog_stats.snapshot())
@@ -0,0 +1,258 @@
+'''
+Prometheus text 格式的執行期指標，由 /metrics 提供，不依賴外部服務或 prometheus_client。
+
+    - Histogram：請求延遲、資料庫操作耗時等
+    - Counter：錯誤次數等累計值
+    - Gauge：連線池、佇列等即時數值
+Gauge 與 Counter 都可以給 callback，在輸出時才讀取數值。
+
+多 worker 時每個 worker 各自統計，/metrics 回傳的是處理該次請求的 worker 的數值（worker_pid 可辨識）。
+
+/metrics 只允許以下來源讀取，其他請求回傳 403：
+    - METRICS_TOKEN 有設定時，帶 `Authorization: Bearer <METRICS_TOKEN>` 的請求
+    - 來源 IP 在 METRICS_ALLOW_IPS 內（逗號分隔的 IP 或 CIDR，預設只有本機 127.0.0.1、::1）
+經過反向代理時來源 IP 是代理的位址，請改用 METRICS_TOKEN。
+'''
+import os
+import hmac
+import time
+import ipaddress
+from functools import wraps
+
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames: tuple, labels: tuple, extra: dict = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in (extra or {}).items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), callback=None):
+        """
+        :param callback: 輸出時呼叫，回傳數值（沒有 label 時）或 {labels tuple: 數值}。
+        """
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def render(self) -> list[str]:
+        values = self._values
+        if self.callback is not None:
+            result = self.callback()
+            values = result if isinstance(result, dict) else {(): result}
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+class Counter(Gauge):
+    """ 只會增加的計數；callback 用於讀取其他物件上已有的累計值 """
+    type_name = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各 bucket 計數, 總和, 次數]
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, {'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, {'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # 重複註冊（例如模組重新載入）時沿用同一個
+        return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+def counter(name: str, documentation: str, labelnames: tuple = (), callback=None) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames, callback))
+
+def gauge(name: str, documentation: str, labelnames: tuple = (), callback=None) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames, callback))
+
+def histogram(name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+gauge("worker_pid", "PID of the worker that served this scrape", callback=os.getpid)
+http_request_duration = histogram("http_request_duration_seconds", "HTTP request latency by route",
+                                  ("method", "route", "status"))
+db_operation_duration = histogram("db_operation_duration_seconds", "Database operation duration", ("operation",))
+db_operation_errors = counter("db_operation_errors_total", "Database operations that raised", ("operation",))
+
+def track_db(func):
+    """ 記錄資料庫操作耗時的裝飾器，operation 為函式名稱 """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            db_operation_errors.inc(func.__name__)
+            raise
+        finally:
+            db_operation_duration.observe(time.perf_counter() - start, func.__name__)
+    return wrapper
+
+scheduler_job_duration = histogram("scheduler_job_duration_seconds", "Scheduled job duration", ("job",))
+scheduler_job_failures = counter("scheduler_job_failures_total", "Scheduled jobs that raised", ("job",))
+
+def track_job(func):
+    """ 記錄排程工作耗時的裝飾器，job 為函式名稱 """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            scheduler_job_failures.inc(func.__name__)
+            raise
+        finally:
+            scheduler_job_duration.observe(time.perf_counter() - start, func.__name__)
+    return wrapper
+
+def register_pool_gauges(db):
+    """ 連線池的 size／idle／waiters，輸出時才讀取 """
+    def pool_state() -> dict:
+        pool = db.db_pool
+        return {
+            ("size",): pool.get_size() if pool else 0,
+            ("idle",): pool.get_idle_size() if pool else 0,
+            ("max",): pool.get_max_size() if pool else 0,
+            ("waiters",): db.pool_waiting,
+        }
+
+    gauge("db_pool_connections", "asyncpg pool connections by state", ("state",), callback=pool_state)
+    gauge("db_pool_wait_seconds_max", "Longest wait to acquire a pool connection",
+          callback=lambda: db.pool_wait_max)
+    counter("db_pool_wait_seconds_total", "Total time spent waiting for pool connections",
+            callback=lambda: db.pool_wait_total)
+
+class MetricsMiddleware:
+    """ 以路由樣板（而非實際路徑）記錄每個請求的延遲，避免 label 數量失控 """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        path = scope["path"]
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_duration.observe(time.perf_counter() - start, scope["method"],
+                                          self.route_label(scope, path, status["code"]), status["code"])
+
+    @staticmethod
+    def route_label(scope, path: str, status_code: int) -> str:
+        route_path = getattr(scope.get("route"), "path", None)
+        if route_path is None:
+            # 沒有對應路由：靜態檔案（mount）或 404
+            return "unmatched" if status_code == 404 else "static"
+        # include_router 的 prefix 不一定包含在 route.path 內，從實際路徑補回前面的段落
+        route_segments = route_path.strip("/").split("/")
+        path_segments = path.strip("/").split("/")
+        prefix = path_segments[:max(0, len(path_segments) - len(route_segments))]
+        return "/" + "/".join(prefix + route_segments) if prefix else route_path
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_ALLOW_IPS = [ipaddress.ip_network(item.strip(), strict=False)
+                     for item in os.getenv("METRICS_ALLOW_IPS", "127.0.0.1,::1").split(",") if item.strip()]
+
+def metrics_allowed(request: Request) -> bool:
+    """ 依 METRICS_TOKEN 與 METRICS_ALLOW_IPS 判斷是否可讀取 /metrics """
+    if METRICS_TOKEN:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(token.strip(), METRICS_TOKEN):
+            return True
+    if request.client is None:
+        return False
+    try:
+        address = ipaddress.ip_address(request.client.host)
+    except ValueError:
+        return False
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return any(address in network for network in METRICS_ALLOW_IPS)
+
+router = APIRouter()
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if not metrics_allowed(request):
+        return Response("Forbidden", status_code=403, media_type="text/plain")
+    return Response(registry.render(), media_type=CONTENT_TYPE)
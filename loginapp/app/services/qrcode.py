@@ -9,14 +9,33 @@ class Qrcode:
         self.scale = scale  # 圖片放大幾倍
         
     # 把 QR Code 的每個黑點放大 scale 倍（每個點變成 10x10 的黑色區塊）
+    # 舊的逐點繪製方式，僅保留給 rasterize_legacy 做效能比較
     def fill_block(self, pixels, x, y, color=(0, 0, 0)):
         block_size = self.scale
         for dx in range(block_size):
             for dy in range(block_size):
                 pixels[x * block_size + dx, y * block_size + dy] = color
-        
-    def output(self, url):
-        qr = QrCode.encode_text(url, QrCode.Ecc.LOW)
+
+    def encode(self, url) -> QrCode:
+        return QrCode.encode_text(url, QrCode.Ecc.LOW)
+
+    def rasterize(self, qr: QrCode) -> Image.Image:
+        """
+        把 QR Code 繪製成圖片：先把模組矩陣組成一張 1 像素 = 1 模組的灰階圖，
+        再以最近鄰一次放大 scale 倍，不用逐點寫入像素。
+
+        :param qr: 已編碼的 QR Code。
+        :return: 1-bit（mode "1"）的圖片。
+        """
+        size = qr.get_size()
+        modules = bytes(
+            0 if qr.get_module(x, y) else 255  # QR Code 黑點
+            for y in range(size) for x in range(size)
+        )
+        img = Image.frombytes("L", (size, size), modules).convert("1", dither=Image.Dither.NONE)
+        return img.resize((size * self.scale, size * self.scale), Image.Resampling.NEAREST)
+
+    def rasterize_legacy(self, qr: QrCode) -> Image.Image:
         size = qr.get_size()
         
         # 創建一個白底黑點的 QR Code 圖片，放大 scale 倍
@@ -27,6 +46,59 @@ class Qrcode:
             for x in range(size):
                 if qr.get_module(x, y):  # QR Code 黑點
                     self.fill_block(pixels, x, y)
+        return img
+
+    def to_svg(self, qr: QrCode) -> str:
+        """
+        直接由模組矩陣產生 SVG，不經過 Pillow。
+        同一列連續的黑點合併成一段，全部放在同一個 path 內。
+
+        :param qr: 已編碼的 QR Code。
+        :return: SVG 內容，寬高為 size * scale 像素。
+        """
+        size = qr.get_size()
+        path = []
+        for y in range(size):
+            x = 0
+            while x < size:
+                if not qr.get_module(x, y):
+                    x += 1
+                    continue
+                start = x
+                while x < size and qr.get_module(x, y):
+                    x += 1
+                # 寬度 1 的水平線畫在該列中央，比四個邊的矩形短很多
+                path.append(f"M{start} {y}.5h{x - start}")
+        pixels = size * self.scale
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+            f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/>'
+            f'<path d="{"".join(path)}" stroke="#000"/></svg>'
+        )
+
+    def output(self, url, fmt: str = "png1"):
+        """
+        產生 QR Code 圖片
+
+        :param url: QR Code 內容。
+        :param fmt: png1（1-bit PNG，預設）、png（24-bit RGB PNG，與舊版相容）或 svg。
+        :return: 圖片內容的 BytesIO。
+        """
+        qr = self.encode(url)
+        if fmt == "svg":
+            return io.BytesIO(self.to_svg(qr).encode("utf-8"))
+        img = self.rasterize(qr)
+        if fmt == "png":
+            img = img.convert("RGB")
+        # 1-bit PNG，畫面與舊版相同，但檔案小很多
+        img_io = io.BytesIO()
+        img.save(img_io, format="PNG")
+        img_io.seek(0)
+        return img_io
+
+    def output_legacy(self, url):
+        img = self.rasterize_legacy(self.encode(url))
         # 轉成 BytesIO 圖片
         img_io = io.BytesIO()
         img.save(img_io, format="PNG")
@@ -0,0 +1,84 @@
+'''
+QR Code 圖片的 LRU 快取。
+
+郵件閘道、代理伺服器常會重複抓同一張 QR Code，快取產生好的 PNG 位元組，
+重複請求不必再經過 qrcodegen 與 Pillow。
+
+以位元組總量限制大小，可用環境變數 QRCODE_CACHE_MAX_BYTES 調整（預設 64 MB，0 表示停用）。
+'''
+import os
+import hashlib
+from collections import OrderedDict
+
+
+class QrcodeCache:
+    def __init__(self, max_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("QRCODE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (圖片內容, ETag)，最近使用的排在最後
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_etag(data: bytes) -> str:
+        """ 以內容雜湊產生 strong ETag """
+        return f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+    def get(self, key: tuple) -> tuple[bytes, str] | None:
+        """
+        取得快取的圖片
+
+        :param key: (logintype, uuid, scale, fmt)
+        :return: (圖片內容, ETag)，沒有快取時回傳 None。
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, data: bytes, etag: str = None) -> tuple[bytes, str]:
+        """
+        放入圖片，超過容量時從最久未使用的開始淘汰
+
+        :param key: (logintype, uuid, scale, fmt)
+        :param data: 圖片內容。
+        :param etag: 指定 ETag，未指定時以內容雜湊產生。
+        :return: (圖片內容, ETag)
+        """
+        entry = (data, etag or self.make_etag(data))
+        # 單張圖片比整個快取還大時不快取
+        if len(data) > self.max_bytes:
+            return entry
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= len(old[0])
+        self._entries[key] = entry
+        self.current_bytes += len(data)
+        while self.current_bytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+            self.evictions += 1
+        return entry
+
+    def stats(self) -> dict:
+        """ 快取統計 """
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+qrcode_cache = QrcodeCache()
@@ -0,0 +1,121 @@
+'''
+預先產生的 QR Code 圖片檔案庫。
+
+活動開始前就知道所有收件者的連結，可以在離峰時段先把整個 sendtask 的 QR Code 產生好存到磁碟，
+寄信當下 qrcode_api 直接回傳檔案（sendfile），不必在尖峰時繪製。
+
+檔名以繪製輸入（網址、放大倍數、格式、繪製版本）的 SHA-256 命名，同樣的輸入一定對應同一個檔案，
+也直接拿來當 ETag。存放路徑可用環境變數 QRCODE_STORE_DIR 調整（預設 ./data/qrcodes）。
+
+預先產生的是預設格式（png1、預設放大倍數）。預先產生整個 sendtask（在 loginapp 目錄下執行）：
+    python -m app.services.qrcode_store <sendtask_uuid> [--logintype test] [--workers 4]
+'''
+import os
+import time
+import asyncio
+import hashlib
+import argparse
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services.render_pool import render_image
+
+
+# 繪製方式改變（輸出內容不同）時調整，舊檔案就不會再被使用
+RENDER_VERSION = 1
+
+class QrcodeStore:
+    def __init__(self, store_dir: str = None):
+        self.store_dir = store_dir or os.getenv("QRCODE_STORE_DIR", "./data/qrcodes")
+
+    @staticmethod
+    def digest(url: str, scale: int, fmt: str = "png1") -> str:
+        """ 繪製輸入的雜湊，作為檔名與 ETag """
+        return hashlib.sha256(f"{RENDER_VERSION}\n{fmt}\n{scale}\n{url}".encode("utf-8")).hexdigest()
+
+    def path(self, digest: str) -> str:
+        # 以前兩碼分目錄，避免單一目錄檔案過多
+        return os.path.join(self.store_dir, digest[:2], f"{digest}.png")
+
+    def lookup(self, digest: str) -> str | None:
+        """ 取得已產生的檔案路徑，沒有時回傳 None """
+        path = self.path(digest)
+        return path if os.path.isfile(path) else None
+
+    def save(self, digest: str, data: bytes):
+        """ 寫入圖片；先寫暫存檔再 rename，讀取端不會讀到寫一半的檔案 """
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+qrcode_store = QrcodeStore()
+
+def pregenerate_one(store_dir: str, url: str, scale: int) -> bool:
+    """
+    在子程序中產生一張 QR Code 並存檔，已存在就略過
+
+    :return: 是否有新產生檔案。
+    """
+    store = QrcodeStore(store_dir)
+    digest = store.digest(url, scale)
+    if store.lookup(digest):
+        return False
+    store.save(digest, render_image(url, scale))
+    return True
+
+def link_uuid(task_uuid: str, person_uuid: str) -> str:
+    """ 收件者連結的 uuid，與 record_api.writer_db 的拆解方式相反 """
+    return person_uuid[16:] + task_uuid + person_uuid[:16]
+
+async def fetch_person_uuids(task_uuid: str) -> list[str]:
+    from app.core.db_controller import db
+
+    await db.db_init()
+    try:
+        return await db.get_person_uuids(task_uuid)
+    finally:
+        await db.db_close()
+
+def pregenerate_sendtask(task_uuid: str, logintype: str = "test", workers: int = None) -> dict:
+    """
+    以 process pool 產生整個 sendtask 所有收件者的 QR Code
+
+    :param task_uuid: sendtask uuid。
+    :param logintype: 登入頁類型（test、googledrive）。
+    :param workers: 子程序數量，預設為 CPU 核心數。
+    :return: 統計資料。
+    """
+    from app.api.qrcode_api import creat_qrcode_url
+    from app.services.qrcode import qrcode
+
+    person_uuids = asyncio.run(fetch_person_uuids(task_uuid))
+    urls = [creat_qrcode_url(logintype, link_uuid(task_uuid, person_uuid)) for person_uuid in person_uuids]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = list(executor.map(
+            partial(pregenerate_one, qrcode_store.store_dir, scale=qrcode.scale), urls, chunksize=64
+        ))
+    return {
+        "sendtask_uuid": task_uuid,
+        "recipients": len(urls),
+        "generated": sum(results),
+        "skipped": len(results) - sum(results),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate QR codes for every recipient of a sendtask")
+    parser.add_argument("sendtask_uuid")
+    parser.add_argument("--logintype", default="test")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    print(pregenerate_sendtask(args.sendtask_uuid, args.logintype, args.workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+'''
+QR Code 繪製的背景執行池。
+
+QR Code 編碼與 PNG 壓縮都是 CPU 密集工作，直接在 async handler 內執行會卡住整個 event loop
+（包含 /api/visit 的紀錄）。這裡把繪製交給 thread 或 process pool，並限制排隊中的數量：
+滿了就丟出 RenderPoolBusy，由 API 直接回 503，不讓整個服務一起變慢。
+
+可用環境變數調整：
+    QRCODE_RENDER_EXECUTOR     process（預設）或 thread；純 Python 的編碼受 GIL 限制，建議用 process
+    QRCODE_RENDER_WORKERS      執行池大小（預設 2）
+    QRCODE_RENDER_MAX_PENDING  最多同時排隊／執行中的繪製數（預設 workers * 4）
+'''
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.services.qrcode import Qrcode
+from app.services.log_manager import Logger
+
+
+logger = Logger().get_logger(__name__)
+
+class RenderPoolBusy(Exception):
+    """ 執行池已滿 """
+
+def render_image(url: str, scale: int, fmt: str = "png1") -> bytes:
+    """
+    產生 QR Code 圖片。放在模組層級，process pool 才能 pickle 傳給子程序。
+
+    :param url: QR Code 內容。
+    :param scale: 放大倍數。
+    :param fmt: 圖片格式（png1、png、svg）。
+    :return: 圖片內容。
+    """
+    return Qrcode(scale=scale).output(url, fmt).getvalue()
+
+class RenderPool:
+    def __init__(self, executor: str = None, workers: int = None, max_pending: int = None):
+        self.executor_type = (executor or os.getenv("QRCODE_RENDER_EXECUTOR", "process")).lower()
+        self.workers = workers or int(os.getenv("QRCODE_RENDER_WORKERS", 2))
+        self.max_pending = max_pending or int(os.getenv("QRCODE_RENDER_MAX_PENDING", self.workers * 4))
+        self._executor = None
+        # (url, scale, fmt) -> Future，同一張圖同時被請求時只繪製一次
+        self._inflight = {}
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.executor_type == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qrcode-render")
+        else:
+            # 用 spawn 避免 fork 帶著 event loop 與連線池的狀態進子程序
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"QR render pool started ({self.executor_type}, workers={self.workers}, "
+                    f"max_pending={self.max_pending})")
+
+    def stop(self, executor=None):
+        """
+        關閉執行池
+
+        :param executor: 只在目前的執行池仍是這一個時才關閉（避免關掉已重建的新執行池）。
+        """
+        if self._executor is None or (executor is not None and executor is not self._executor):
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._inflight)
+
+    async def render(self, url: str, scale: int, fmt: str = "png1") -> bytes:
+        """
+        在執行池中產生 QR Code 圖片
+
+        :param url: QR Code 內容。
+        :param scale: 放大倍數。
+        :param fmt: 圖片格式（png1、png、svg）。
+        :return: 圖片內容。
+        :raises RenderPoolBusy: 排隊中的繪製已達上限，或 process pool 異常。
+        """
+        key = (url, scale, fmt)
+        executor = self._executor
+        future = self._inflight.get(key)
+        if future is None:
+            if len(self._inflight) >= self.max_pending:
+                raise RenderPoolBusy(f"{len(self._inflight)} renders pending")
+            self.start()
+            executor = self._executor
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(executor, render_image, url, scale, fmt)
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        try:
+            # shield：其中一個請求斷線時，不取消其他請求共用的繪製
+            return await asyncio.shield(future)
+        except BrokenProcessPool as e:
+            # 子程序異常結束後整個 pool 無法再用，下次請求時重建；這次同樣回 503
+            logger.error("QR render process pool is broken, recreating it")
+            self.stop(executor)
+            raise RenderPoolBusy("render process pool is broken") from e
+
+
+render_pool = RenderPool()
@@ -0,0 +1,140 @@
+'''
+有效 sendtask 的記憶體登錄表。
+
+格式錯誤或已失效的連結（掃描器、爬到舊信件的爬蟲）不必進到資料庫就能直接拒絕。
+    - 啟動時讀取 sendlog 底下所有分區（sendlog_<sendtask_uuid>）
+    - 以專用連線 LISTEN adminapp 建立／卸下分區時發出的 NOTIFY，即時更新
+    - 連線中斷期間與首次載入完成前一律放行（fail open），不因登錄表異常漏記真實點擊
+
+可用環境變數調整：
+    TABLE_NOTIFY_CHANNEL    NOTIFY 頻道（預設 sendtask_tables，需與 adminapp 相同）
+    TASK_REGISTRY_REFRESH   定期全量重新載入的間隔秒數，防止漏收通知（預設 300）
+    TASK_REGISTRY_RETRY     LISTEN 連線中斷後的重連間隔秒數（預設 5）
+'''
+import os
+import re
+import asyncio
+import asyncpg
+
+from app.core.db_controller import connection_params
+from app.services.log_manager import Logger
+
+
+logger = Logger().get_logger(__name__)
+
+# 連結內的 sendtask uuid 為 32 碼英數
+TASK_TABLE_PATTERN = re.compile(r'^[a-zA-Z0-9]{32}$')
+# sendlog 分區的名稱前綴，其後為 sendtask uuid
+PARTITION_PREFIX = "sendlog_"
+
+class TaskRegistry:
+    def __init__(self, channel: str = None, refresh_interval: float = None, retry_interval: float = None):
+        self.channel = channel or os.getenv("TABLE_NOTIFY_CHANNEL", "sendtask_tables")
+        self.refresh_interval = refresh_interval or float(os.getenv("TASK_REGISTRY_REFRESH", 300))
+        self.retry_interval = retry_interval or float(os.getenv("TASK_REGISTRY_RETRY", 5))
+        self.tasks = set()
+        self.loaded = False
+        self._task = None
+        self._connection = None
+        self._lost = asyncio.Event()
+        # 全量載入期間收到的通知，載入完成後再套用
+        self._pending = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close_connection()
+
+    def is_known(self, task_uuid: str) -> bool:
+        """
+        檢查是否為有效的任務（sendlog 有對應的分區）
+
+        :param task_uuid: sendtask uuid。
+        :return: 登錄表尚未載入（或 LISTEN 中斷）時一律回傳 True。
+        """
+        if not TASK_TABLE_PATTERN.match(task_uuid):
+            return False
+        return not self.loaded or task_uuid in self.tasks
+
+    async def _run(self):
+        while True:
+            try:
+                await self._connect()
+                # 正常情況下一直等到連線中斷；逾時就做一次全量重新載入
+                while True:
+                    try:
+                        await asyncio.wait_for(self._lost.wait(), timeout=self.refresh_interval)
+                        break
+                    except asyncio.TimeoutError:
+                        await self._load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Task registry connection failed: {e}")
+            self.loaded = False
+            await self._close_connection()
+            await asyncio.sleep(self.retry_interval)
+
+    async def _connect(self):
+        self._lost.clear()
+        self._connection = await asyncpg.connect(**connection_params())
+        self._connection.add_termination_listener(lambda connection: self._lost.set())
+        # 先 LISTEN 再載入，載入期間發生的變更不會漏掉
+        await self._connection.add_listener(self.channel, self._on_notify)
+        await self._load()
+
+    async def _load(self):
+        self._pending = []
+        try:
+            # 只算仍掛在 sendlog 底下的分區，已 detach 封存的任務視為失效
+            rows = await self._connection.fetch(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass('sendlog')"
+            )
+            names = (row["relname"][len(PARTITION_PREFIX):] for row in rows if row["relname"].startswith(PARTITION_PREFIX))
+            tasks = {name for name in names if TASK_TABLE_PATTERN.match(name)}
+            for action, table_name in self._pending:
+                self._apply(tasks, action, table_name)
+            self.tasks = tasks
+        finally:
+            self._pending = None
+        if not self.loaded:
+            logger.info(f"Task registry loaded {len(self.tasks)} tasks")
+        self.loaded = True
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        """ payload 格式為 create:<sendtask_uuid> 或 drop:<sendtask_uuid> """
+        action, _, table_name = payload.partition(":")
+        if not TASK_TABLE_PATTERN.match(table_name):
+            return
+        if self._pending is not None:
+            self._pending.append((action, table_name))
+        self._apply(self.tasks, action, table_name)
+        logger.debug("Task registry %s: %s", action, table_name)
+
+    @staticmethod
+    def _apply(tasks: set, action: str, table_name: str):
+        if action == "create":
+            tasks.add(table_name)
+        elif action == "drop":
+            tasks.discard(table_name)
+
+    async def _close_connection(self):
+        if self._connection is not None:
+            try:
+                await self._connection.close(timeout=5)
+            except Exception:
+                self._connection.terminate()
+            self._connection = None
+
+
+task_registry = TaskRegistry()
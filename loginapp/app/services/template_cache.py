@@ -0,0 +1,154 @@
+'''
+登入頁模板的記憶體快取。
+
+每位收件者都會開一次登入頁，因此啟動時就把模板讀進記憶體，並預先壓好 gzip / brotli：
+    - 請求時不再讀檔、也不再壓縮
+    - 回應帶 ETag、Last-Modified，瀏覽器重新驗證時直接回 304
+
+開發時設定環境變數 TEMPLATE_AUTO_RELOAD=1，檔案修改後會自動重新載入。
+brotli 套件為選用，未安裝時只提供 gzip。
+'''
+import os
+import gzip
+import time
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.services.log_manager import Logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = Logger().get_logger(__name__)
+
+class CachedTemplate:
+    def __init__(self, path: str):
+        self.path = path
+        self.load()
+
+    def load(self):
+        """ 讀取檔案並預先計算壓縮版本與驗證標頭 """
+        with open(self.path, "rb") as f:
+            body = f.read()
+        self.mtime = int(os.stat(self.path).st_mtime)
+        self.variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+        # 各壓縮版本內容相同，使用 weak ETag 共用同一個值
+        self.etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+
+class TemplateCache:
+    def __init__(self, directory: str = "app/templates", auto_reload: bool = None, reload_interval: float = 1.0):
+        self.directory = directory
+        if auto_reload is None:
+            auto_reload = os.getenv("TEMPLATE_AUTO_RELOAD", "").lower() in ("1", "true", "yes")
+        self.auto_reload = auto_reload
+        # 自動重新載入時，最多每隔 reload_interval 秒檢查一次檔案
+        self.reload_interval = reload_interval
+        self._templates = {}
+        self._checked = {}
+
+    def load(self, *names: str):
+        """
+        啟動時預先載入模板，缺檔只記錄錯誤，請求時回 404（開啟自動重新載入時會再嘗試讀取）。
+
+        :param names: 模板檔名。
+        """
+        for name in names:
+            try:
+                self._templates[name] = CachedTemplate(os.path.join(self.directory, name))
+            except OSError as e:
+                logger.error(f"Failed to load template {name}: {e}")
+
+    def get(self, name: str) -> CachedTemplate:
+        """ 取得模板，開啟自動重新載入時會檢查檔案是否有修改 """
+        template = self._templates.get(name)
+        if not self.auto_reload:
+            return template
+        now = time.monotonic()
+        if now - self._checked.get(name, 0) < self.reload_interval:
+            return template
+        self._checked[name] = now
+        if template is None:
+            self.load(name)
+            return self._templates.get(name)
+        try:
+            if int(os.stat(template.path).st_mtime) != template.mtime:
+                template.load()
+                logger.info(f"Reloaded template {name}")
+        except OSError as e:
+            logger.error(f"Failed to reload template {name}: {e}")
+        return template
+
+    @staticmethod
+    def _accepted_encodings(accept_encoding: str) -> set[str]:
+        """ 解析 Accept-Encoding，排除 q=0 的編碼 """
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.strip().partition(";")
+            params = params.replace(" ", "")
+            if params.startswith("q="):
+                try:
+                    if float(params[2:]) == 0:
+                        continue
+                except ValueError:
+                    continue
+            if coding:
+                accepted.add(coding.lower())
+        return accepted
+
+    @staticmethod
+    def _not_modified(request: Request, template: CachedTemplate) -> bool:
+        """ 依 If-None-Match（優先）或 If-Modified-Since 判斷是否可回 304 """
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            # weak 比對：忽略 W/ 前綴
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return template.etag.removeprefix("W/") in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                return template.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def response(self, request: Request, name: str) -> Response:
+        """
+        回傳模板內容，依 Accept-Encoding 選擇預先壓縮的版本。
+
+        :param request: 目前的請求。
+        :param name: 模板檔名。
+        :return: 200（或 304）回應；模板不存在時回 404。
+        """
+        template = self.get(name)
+        if template is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+
+        headers = {
+            "ETag": template.etag,
+            "Last-Modified": template.last_modified,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if self._not_modified(request, template):
+            return Response(status_code=304, headers=headers)
+
+        accepted = self._accepted_encodings(request.headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in template.variants and encoding in accepted:
+                headers["Content-Encoding"] = encoding
+                return Response(template.variants[encoding], media_type="text/html; charset=utf-8", headers=headers)
+        return Response(template.variants["identity"], media_type="text/html; charset=utf-8", headers=headers)
+
+
+template_cache = TemplateCache()
@@ -0,0 +1,110 @@
+'''
+重複開啟頁面的合併。
+
+重新整理、連結預取、郵件安全掃描常會在短時間內重複打 /api/visit，
+每一次都會在收件者的紀錄陣列多附加一筆。這裡以 (task, 收件者, ip) 為 key，在時間窗內：
+    - 第一次開啟照常寫入（first-seen）
+    - 之後的重複開啟只計數
+    - 時間窗結束時若有重複，補寫一筆 visit_repeat:<次數>，時間為最後一次開啟（last-seen）
+
+只在單一程序的記憶體內合併；多 worker 時各 worker 分別合併。
+登入（/api/login）不合併。
+
+可用環境變數調整：
+    VISIT_DEDUP_WINDOW    時間窗秒數（預設 0，表示停用）
+    VISIT_DEDUP_MAX_KEYS  最多追蹤幾個 key，超過時提早結束最舊的時間窗（預設 100000）
+'''
+import os
+import time
+import uuid
+import asyncio
+
+from app.services.event_queue import event_queue
+from app.services.log_manager import Logger
+
+
+logger = Logger().get_logger(__name__)
+
+class VisitDedup:
+    def __init__(self, window: int = None, max_keys: int = None):
+        self.window = window if window is not None else int(os.getenv("VISIT_DEDUP_WINDOW", 0))
+        self.max_keys = max_keys or int(os.getenv("VISIT_DEDUP_MAX_KEYS", 100000))
+        # (task_uuid, person_uuid, ip) -> [first_seen, last_seen, 重複次數]，依 first_seen 排序（dict 保留插入順序）
+        self._entries = {}
+        self._task = None
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def allow(self, key: tuple, now: int) -> bool:
+        """
+        判斷這次開啟是否需要寫入
+
+        :param key: (task_uuid, person_uuid, ip)
+        :param now: 開啟時間（秒）。
+        :return: True 表示時間窗內第一次開啟，需要寫入；False 表示只計數。
+        """
+        if not self.enabled:
+            return True
+        entry = self._entries.get(key)
+        if entry is not None and now < entry[0] + self.window:
+            entry[1] = max(entry[1], now)
+            entry[2] += 1
+            self.coalesced += 1
+            return False
+        if entry is not None:
+            # 時間窗已過但尚未被清掉，先補寫上一個時間窗的重複紀錄
+            await self._close(key, self._entries.pop(key))
+        self._entries[key] = [now, now, 0]
+        if len(self._entries) > self.max_keys:
+            oldest = next(iter(self._entries))
+            await self._close(oldest, self._entries.pop(oldest))
+        return True
+
+    async def _close(self, key: tuple, entry: list):
+        """ 結束一個時間窗，有重複開啟時補寫一筆 visit_repeat """
+        first_seen, last_seen, repeats = entry
+        if not repeats:
+            return
+        task_uuid, person_uuid, ip = key
+        await event_queue.put((uuid.uuid4().hex, task_uuid, person_uuid, f"visit_repeat:{repeats}", ip, last_seen))
+
+    async def sweep(self, now: int = None):
+        """ 結束所有已過期的時間窗 """
+        now = now if now is not None else int(time.time())
+        expired = []
+        # 依 first_seen 排序，遇到第一個未過期的就可以停止
+        for key, entry in self._entries.items():
+            if now < entry[0] + self.window:
+                break
+            expired.append(key)
+        for key in expired:
+            await self._close(key, self._entries.pop(key))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(max(1, self.window / 2))
+            await self.sweep()
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Visit de-duplication enabled (window={self.window}s)")
+
+    async def stop(self):
+        """ 停止背景清理，並補寫所有尚未結束的時間窗 """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        entries, self._entries = self._entries, {}
+        for key, entry in entries.items():
+            await self._close(key, entry)
+
+
+visit_dedup = VisitDedup()
@@ -0,0 +1,62 @@
+'''
+QR Code 繪製效能比較：逐點 fill_block（rasterize_legacy）與整批放大（rasterize）。
+
+qrcodegen 編碼（純 Python）的耗時兩者相同，另外列出；繪製與 PNG 輸出分開計時。
+在 loginapp 目錄下執行：
+    python -m benchmarks.bench_qrcode [--rounds 20] [--scale 10]
+'''
+import io
+import time
+import argparse
+
+from PIL import Image, ImageChops
+
+from app.services.qrcode import Qrcode
+
+
+# 不同長度的網址會落在不同的 QR Code 版本
+URL_LENGTHS = (40, 120, 250, 500, 1000)
+
+def make_url(length: int) -> str:
+    base = "https://se2.link.cc/a/l/"
+    return base + "x" * max(0, length - len(base))
+
+def timed(func, rounds: int):
+    """ 回傳平均耗時（毫秒）與最後一次的結果 """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = func()
+    return (time.perf_counter() - start) / rounds * 1000, result
+
+def to_png(img: Image.Image) -> bytes:
+    img_io = io.BytesIO()
+    img.save(img_io, format="PNG")
+    return img_io.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare QR code renderers")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--scale", type=int, default=10)
+    args = parser.parse_args()
+
+    qrcode = Qrcode(scale=args.scale)
+    print(f"{'version':>7} {'px':>5} {'encode':>8} {'legacy':>8} {'new':>6} {'speedup':>8} "
+          f"{'png old':>8} {'png new':>8} {'old B':>6} {'new B':>6} same")
+    for length in URL_LENGTHS:
+        url = make_url(length)
+        encode_ms, qr = timed(lambda: qrcode.encode(url), args.rounds)
+        legacy_ms, legacy_img = timed(lambda: qrcode.rasterize_legacy(qr), args.rounds)
+        new_ms, new_img = timed(lambda: qrcode.rasterize(qr), args.rounds)
+        legacy_png_ms, legacy_png = timed(lambda: to_png(legacy_img), args.rounds)
+        new_png_ms, new_png = timed(lambda: to_png(new_img), args.rounds)
+
+        # 確認兩種繪製方式畫面完全相同
+        same = ImageChops.difference(legacy_img.convert("L"), new_img.convert("L")).getbbox() is None
+
+        print(f"{qr.get_version():>7} {new_img.width:>5} {encode_ms:>8.2f} {legacy_ms:>8.2f} {new_ms:>6.2f} "
+              f"{legacy_ms / new_ms:>7.1f}x {legacy_png_ms:>8.2f} {new_png_ms:>8.2f} "
+              f"{len(legacy_png):>6} {len(new_png):>6} {same}")
+    print("times in ms, averaged over", args.rounds, "rounds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+'''
+/api/visit、/api/login 紀錄路徑的壓力測試。
+
+在本機 Postgres 的 sendlog 建立假的 sendtask 分區與收件者，依活動開信的形狀重播事件：
+寄出後前幾分鐘湧入大部分的開信，部分收件者重複開啟，部分開信後登入。
+結束後等待背景 flusher 寫完，核對資料庫內的紀錄筆數，並列出延遲分位數、錯誤數與連線池等待時間。
+
+需先啟動過 adminapp 建立 sendlog 分區表，並安裝 benchmarks/requirements.txt（另外需要 httpx）：
+    pip install -r benchmarks/requirements.txt
+在 loginapp 目錄下執行（資料庫連線用 DB_HOST、DB_PORT、DB_USER、DB_PASSWORD、DB_NAME 設定）：
+    DB_HOST=localhost python -m benchmarks.loadtest_recording --tasks 2 --recipients 2000 --burst 30
+
+預設在同一個程序內透過 ASGI 呼叫 app（含 lifespan），可直接看到連線池等待時間；
+加上 --base-url 則改打已啟動的服務（例如多 worker 的 production 模式）。
+'''
+import os
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+
+# spool 寫到暫存目錄，不影響正式資料
+os.environ.setdefault("EVENT_SPOOL_DIR", tempfile.mkdtemp(prefix="loadtest-spool-"))
+
+import httpx
+
+from app.main import app
+from app.core.db_controller import db
+from app.services.event_queue import event_queue
+from app.services.qrcode_store import link_uuid
+from app.services.task_registry import task_registry
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def create_tasks(task_count: int, recipients: int) -> dict[str, list[str]]:
+    """ 在 sendlog 建立假的任務分區，回傳 {task_uuid: [person_uuid, ...]} """
+    if not await db._execute(lambda connection: connection.fetchval("SELECT to_regclass($1) IS NOT NULL", db.sendlog_table)):
+        raise SystemExit(f"table {db.sendlog_table} not found; start adminapp once to create the schema")
+    tasks = {}
+    for _ in range(task_count):
+        task_uuid = uuid.uuid4().hex
+        person_uuids = [uuid.uuid4().hex for _ in range(recipients)]
+
+        async def create(connection):
+            await connection.execute(
+                f'CREATE TABLE "{db.sendlog_table}_{task_uuid}" PARTITION OF "{db.sendlog_table}" '
+                f"FOR VALUES IN ('{task_uuid}')"
+            )
+            await connection.copy_records_to_table(db.sendlog_table, records=[(task_uuid, p) for p in person_uuids],
+                                                   columns=["sendtask_uuid", "uuid"])
+            # 與 adminapp 建立分區時相同，通知任務登錄表
+            await connection.execute("SELECT pg_notify($1, $2)", task_registry.channel, f"create:{task_uuid}")
+
+        await db._execute(create)
+        tasks[task_uuid] = person_uuids
+    return tasks
+
+async def drop_tasks(tasks: dict[str, list[str]]):
+    async def drop(connection):
+        for task_uuid in tasks:
+            await connection.execute(f'DROP TABLE IF EXISTS "{db.sendlog_table}_{task_uuid}"')
+            await connection.execute("SELECT pg_notify($1, $2)", task_registry.channel, f"drop:{task_uuid}")
+        await connection.execute(f'DELETE FROM "{db.events_table}" WHERE task_uuid = ANY($1::TEXT[])', list(tasks))
+
+    await db._execute(drop)
+
+async def count_recorded(tasks: dict[str, list[str]]) -> int:
+    return await db._execute(lambda connection: connection.fetchval(
+        f'SELECT COALESCE(SUM(array_length(qrcode_access_active, 1)), 0) FROM "{db.sendlog_table}" '
+        'WHERE sendtask_uuid = ANY($1::TEXT[])', list(tasks)
+    ))
+
+def build_schedule(tasks: dict[str, list[str]], args) -> list[tuple[float, str, dict, dict]]:
+    """
+    產生 (送出時間, 路徑, body, headers) 的事件列表。
+    開信時間取指數分佈，大部分集中在 burst 秒內的前段。
+    """
+    schedule = []
+    for task_uuid, person_uuids in tasks.items():
+        for person_uuid in person_uuids:
+            if random.random() > args.open_rate:
+                continue
+            url = f"http://localhost:8090/login/test/{link_uuid(task_uuid, person_uuid)}"
+            headers = {"x-forwarded-for": f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"}
+            at = min(random.expovariate(3 / args.burst), args.burst)
+            # 第一次開信之後，依 repeat_rate 持續重複開啟
+            visits = 1
+            while random.random() < args.repeat_rate:
+                visits += 1
+            for i in range(visits):
+                schedule.append((at + i * random.uniform(0.05, 2.0), "/api/visit", {"url": url}, headers))
+            if random.random() < args.login_rate:
+                body = {"url": url, "email": f"{person_uuid[:8]}@example.com"}
+                schedule.append((at + random.uniform(1.0, 5.0), "/api/login", body, headers))
+    schedule.sort(key=lambda event: event[0])
+    return schedule
+
+async def replay(client: httpx.AsyncClient, schedule: list, concurrency: int) -> dict:
+    latencies = {"/api/visit": [], "/api/login": []}
+    errors = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def send(at: float, path: str, body: dict, headers: dict):
+        delay = at - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            sent = time.perf_counter()
+            try:
+                response = await client.post(path, json=body, headers=headers)
+                if response.status_code >= 400:
+                    errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+                    return
+            except httpx.HTTPError as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                return
+            latencies[path].append(time.perf_counter() - sent)
+
+    await asyncio.gather(*(send(*event) for event in schedule))
+    return {"latencies": latencies, "errors": errors, "seconds": time.perf_counter() - start}
+
+async def wait_for_flush(timeout: float = 60.0) -> float:
+    """ 等背景 flusher 把佇列寫完 """
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if event_queue.queue is not None and event_queue.queue.empty():
+            # 最後一批可能還在寫入中，多等一個 flush 週期
+            await asyncio.sleep(event_queue.flush_interval * 2)
+            if event_queue.queue.empty():
+                break
+        await asyncio.sleep(0.1)
+    return time.perf_counter() - start
+
+def report(result: dict, sent: int, recorded: int, drain_seconds: float, pool: dict | None):
+    ok = sum(len(samples) for samples in result["latencies"].values())
+    print(f"requests: {sent}, ok: {ok}, errors: {result['errors'] or 0}")
+    print(f"replay: {result['seconds']:.1f}s, throughput: {sent / result['seconds']:.0f} req/s, "
+          f"drain after replay: {drain_seconds:.1f}s")
+    print(f"{'path':<12} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for path, samples in result["latencies"].items():
+        print(f"{path:<12} {len(samples):>7} {percentile(samples, 50) * 1000:>8.2f} "
+              f"{percentile(samples, 95) * 1000:>8.2f} {percentile(samples, 99) * 1000:>8.2f} "
+              f"{max(samples, default=0) * 1000:>8.2f}")
+    print(f"recorded in sendlog: {recorded} / {ok}")
+    if pool is not None:
+        print(f"db pool: {pool}")
+
+async def main(args):
+    random.seed(args.seed)
+    async with app.router.lifespan_context(app):
+        tasks = await create_tasks(args.tasks, args.recipients)
+        try:
+            schedule = build_schedule(tasks, args)
+            print(f"{len(tasks)} tasks x {args.recipients} recipients, {len(schedule)} events over ~{args.burst}s")
+            if args.base_url:
+                transport = None
+            else:
+                transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 12345))
+            async with httpx.AsyncClient(transport=transport, base_url=args.base_url or "http://loadtest",
+                                         timeout=30) as client:
+                result = await replay(client, schedule, args.concurrency)
+            drain_seconds = await wait_for_flush() if not args.base_url else 0.0
+            if args.base_url:
+                # 服務在其他程序內 flush，等一下再核對
+                await asyncio.sleep(args.settle)
+            recorded = await count_recorded(tasks)
+            report(result, len(schedule), recorded, drain_seconds, None if args.base_url else db.pool_stats())
+        finally:
+            if not args.keep:
+                await drop_tasks(tasks)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the loginapp recording path")
+    parser.add_argument("--tasks", type=int, default=1, help="number of synthetic sendtasks")
+    parser.add_argument("--recipients", type=int, default=1000, help="recipients per task")
+    parser.add_argument("--burst", type=float, default=30.0, help="seconds over which most opens arrive")
+    parser.add_argument("--open-rate", type=float, default=0.6, help="share of recipients who open the link")
+    parser.add_argument("--repeat-rate", type=float, default=0.3, help="chance of each additional repeat visit")
+    parser.add_argument("--login-rate", type=float, default=0.25, help="share of visitors who submit the form")
+    parser.add_argument("--concurrency", type=int, default=200, help="max in-flight requests")
+    parser.add_argument("--base-url", default=None, help="target a running server instead of the in-process app")
+    parser.add_argument("--settle", type=float, default=5.0, help="seconds to wait for a remote server to flush")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic partitions afterwards")
+    asyncio.run(main(parser.parse_args()))